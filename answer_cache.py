@@ -0,0 +1,103 @@
+import os
+import time
+import hashlib
+import threading
+from typing import List, Optional
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")) # Min cosine similarity for a hit
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400")) # Seconds an answer stays valid
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000")) # Max cached answers
+
+
+def fingerprint_chunks(node_ids: List[str]) -> str:
+    """Order-independent fingerprint of the retrieved chunk ids."""
+    return hashlib.sha1("\n".join(sorted(node_ids)).encode("utf-8")).hexdigest()
+
+
+def fingerprint_conversation(conversation: str, intent: str) -> str:
+    """Fingerprint of what else shapes an answer: the conversation so far and the routed intent."""
+    return hashlib.sha1(f"{intent}\0{conversation}".encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    In-process cache of reviewed answers, shared by every session.
+
+    An entry matches when the retrieved chunks, the conversation and the routed
+    intent have the same fingerprints and the cosine similarity of the query
+    embeddings clears `threshold`, so reworded questions over the same evidence,
+    in the same conversation and asking for the same kind of answer, skip both
+    Groq calls. Every entry remembers
+    the knowledge-base version it was built against, and the whole cache is
+    dropped as soon as a lookup sees a newer one (e.g. after ingest.py ran).
+    Entries expire after `ttl` seconds, and the least recently used ones are
+    evicted beyond `max_entries`.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = [] # dicts: embedding, fingerprint, conversation, answer, created, last_used
+        self._kb_version = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync_version(self, kb_version):
+        if kb_version != self._kb_version:
+            self._entries = []
+            self._kb_version = kb_version
+
+    def lookup(self, query_embedding, chunk_fingerprint: str, kb_version,
+               conversation_fingerprint: str = "") -> Optional[str]:
+        now = time.time()
+        query = self._normalize(query_embedding)
+        with self._lock:
+            self._sync_version(kb_version)
+            self._entries = [e for e in self._entries if now - e["created"] < self.ttl]
+            best, best_score = None, self.threshold
+            for entry in self._entries:
+                if entry["fingerprint"] != chunk_fingerprint or entry["conversation"] != conversation_fingerprint:
+                    continue
+                score = float(np.dot(query, entry["embedding"]))
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.misses += 1
+                return None
+            best["last_used"] = now
+            self.hits += 1
+            return best["answer"]
+
+    def store(self, query_embedding, chunk_fingerprint: str, kb_version, answer: str,
+              conversation_fingerprint: str = ""):
+        now = time.time()
+        with self._lock:
+            self._sync_version(kb_version)
+            self._entries.append({
+                "embedding": self._normalize(query_embedding),
+                "fingerprint": chunk_fingerprint,
+                "conversation": conversation_fingerprint,
+                "answer": answer,
+                "created": now,
+                "last_used": now,
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries.sort(key=lambda e: e["last_used"])
+                del self._entries[:len(self._entries) - self.max_entries]
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+
+
+answer_cache = AnswerCache()
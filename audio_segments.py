@@ -0,0 +1,168 @@
+import os
+import re
+import wave
+import shutil
+import subprocess
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import numpy as np
+
+AUDIO_SEGMENT_SECONDS = float(os.getenv("AUDIO_SEGMENT_SECONDS", "300")) # Max audio per Whisper request
+AUDIO_MIN_SEGMENT_SECONDS = float(os.getenv("AUDIO_MIN_SEGMENT_SECONDS", "120")) # Don't cut on silence before this
+AUDIO_SILENCE_DB = float(os.getenv("AUDIO_SILENCE_DB", "-35")) # Quieter than this (dBFS) counts as silence
+AUDIO_SILENCE_SECONDS = 0.4 # Min pause length to cut on
+AUDIO_NODE_SECONDS = float(os.getenv("AUDIO_NODE_SECONDS", "60")) # Transcript stored in pieces of about this long
+WAV_BLOCK_SECONDS = 0.1 # Loudness resolution of the wave fallback
+
+_SILENCE_START = re.compile(r"silence_start:\s*(-?[\d.]+)")
+_SILENCE_END = re.compile(r"silence_end:\s*([\d.]+)")
+
+
+@dataclass
+class AudioSegment:
+    path: str # Audio file to upload (an exported piece, or the original file)
+    start: float # Seconds from the start of the recording
+    end: Optional[float] # None if the length is unknown (unsplit file without ffmpeg)
+
+
+def format_timestamp(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def has_ffmpeg() -> bool:
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+# --- Silence Detection ---
+def ffmpeg_duration(path: str) -> float:
+    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+                            check=True, capture_output=True, text=True)
+    return float(result.stdout.strip())
+
+def ffmpeg_silences(path: str) -> List[Tuple[float, float]]:
+    """(start, end) of every pause, from ffmpeg's silencedetect filter (decodes as a stream, nothing kept)."""
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-nostats", "-i", path, "-af",
+                             f"silencedetect=noise={AUDIO_SILENCE_DB}dB:d={AUDIO_SILENCE_SECONDS}", "-f", "null", "-"],
+                            check=True, capture_output=True, text=True)
+    starts = [max(0.0, float(s)) for s in _SILENCE_START.findall(result.stderr)]
+    ends = [float(e) for e in _SILENCE_END.findall(result.stderr)]
+    return list(zip(starts, ends))
+
+def wav_duration(path: str) -> float:
+    with wave.open(path, "rb") as wav:
+        return wav.getnframes() / wav.getframerate()
+
+def wav_silences(path: str) -> List[Tuple[float, float]]:
+    """(start, end) of every pause in a 16-bit PCM wave file, reading it block by block."""
+    silences = []
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            return [] # Only cut fixed windows
+        block = max(1, int(wav.getframerate() * WAV_BLOCK_SECONDS))
+        quiet_since, position = None, 0.0
+        while True:
+            frames = wav.readframes(block)
+            if not frames:
+                break
+            samples = np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32768.0
+            level = 20 * np.log10(max(float(np.sqrt(np.mean(samples ** 2))), 1e-10))
+            if level < AUDIO_SILENCE_DB:
+                quiet_since = position if quiet_since is None else quiet_since
+            elif quiet_since is not None:
+                if position - quiet_since >= AUDIO_SILENCE_SECONDS:
+                    silences.append((quiet_since, position))
+                quiet_since = None
+            position += len(samples) / wav.getnchannels() / wav.getframerate()
+    return silences
+
+
+def plan_segments(duration: float, silences: List[Tuple[float, float]], max_seconds: float = AUDIO_SEGMENT_SECONDS,
+                  min_seconds: float = AUDIO_MIN_SEGMENT_SECONDS) -> List[Tuple[float, float]]:
+    """
+    Cut points for segments of at most `max_seconds`: in the middle of the last pause
+    between `min_seconds` and `max_seconds` into the segment, or at `max_seconds` if there is none.
+    """
+    pauses = [(start + end) / 2 for start, end in silences]
+    segments, start = [], 0.0
+    while duration - start > max_seconds:
+        candidates = [p for p in pauses if start + min(min_seconds, max_seconds) <= p <= start + max_seconds]
+        cut = round(candidates[-1] if candidates else start + max_seconds, 3)
+        segments.append((start, cut))
+        start = cut
+    segments.append((start, duration))
+    return segments
+
+
+# --- Export ---
+def ffmpeg_export(path: str, start: float, end: float, out_path: str):
+    # 16 kHz mono FLAC: what Whisper decodes to anyway, lossless and small
+    subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}",
+                    "-i", path, "-ac", "1", "-ar", "16000", "-c:a", "flac", out_path], check=True)
+
+def wav_export(path: str, start: float, end: float, out_path: str):
+    with wave.open(path, "rb") as source, wave.open(out_path, "wb") as target:
+        target.setparams(source.getparams())
+        rate = source.getframerate()
+        source.setpos(int(start * rate))
+        remaining = int((end - start) * rate)
+        while remaining > 0:
+            frames = source.readframes(min(remaining, rate * 10)) # 10 s at a time
+            if not frames:
+                break
+            target.writeframes(frames)
+            remaining -= len(frames) // (source.getsampwidth() * source.getnchannels())
+
+
+def split_audio(path: str, workdir: str) -> List[AudioSegment]:
+    """
+    Split a recording into pieces of at most AUDIO_SEGMENT_SECONDS, cut on pauses,
+    written to `workdir`. Uses ffmpeg when installed; without it, wave files are
+    split with the standard library and other formats are uploaded whole.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if has_ffmpeg():
+        duration, silences, export, extension = ffmpeg_duration(path), ffmpeg_silences(path), ffmpeg_export, ".flac"
+    elif extension == ".wav":
+        duration, silences, export = wav_duration(path), wav_silences(path), wav_export
+    else:
+        print(f"⚠️ ffmpeg not found, uploading {os.path.basename(path)} unsplit.")
+        return [AudioSegment(path, 0.0, None)]
+
+    bounds = plan_segments(duration, silences)
+    if len(bounds) == 1:
+        return [AudioSegment(path, 0.0, duration)] # Short enough as it is
+    segments = []
+    for i, (start, end) in enumerate(bounds):
+        out_path = os.path.join(workdir, f"segment_{i:04d}{extension}")
+        export(path, start, end, out_path)
+        segments.append(AudioSegment(out_path, start, end))
+    return segments
+
+
+# --- Timestamped Transcript ---
+def _field(item, name):
+    return item.get(name) if isinstance(item, dict) else getattr(item, name, None)
+
+def transcript_pieces(segment: AudioSegment, transcription, node_seconds: float = AUDIO_NODE_SECONDS):
+    """
+    (start, end, text) pieces of about `node_seconds`, in recording time. Built from
+    Whisper's own timestamped segments when the response has them (verbose_json),
+    else the whole upload is one piece.
+    """
+    timed = _field(transcription, "segments") or []
+    if not timed:
+        text = (_field(transcription, "text") or "").strip()
+        return [(segment.start, segment.end, text)] if text else []
+    pieces, texts, piece_start, piece_end = [], [], None, None
+    for item in timed:
+        start, end = segment.start + float(_field(item, "start")), segment.start + float(_field(item, "end"))
+        if piece_start is not None and end - piece_start > node_seconds and texts:
+            pieces.append((piece_start, piece_end, " ".join(texts)))
+            texts, piece_start = [], None
+        piece_start = start if piece_start is None else piece_start
+        piece_end = end
+        texts.append((_field(item, "text") or "").strip())
+    if texts:
+        pieces.append((piece_start, piece_end, " ".join(texts)))
+    return [(start, end, text) for start, end, text in pieces if text]
@@ -0,0 +1,179 @@
+"""
+Bulk question answering: run a JSONL file of questions through the agent graph.
+
+    python batch.py questions.jsonl -o answers.jsonl --concurrency 8
+
+Each input line is {"id": ..., "question": ..., "filters": {...}}; "id" defaults
+to the line number and "filters" (see filters.RetrievalFilter) is optional. A
+line holding just a JSON string is a question too. Questions are answered
+independently, without conversation memory.
+
+Results are appended to the output JSONL as they finish. Re-running the same
+command resumes an interrupted run: ids already answered are skipped, failed
+ones are tried again.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import numpy as np
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4")) # Questions in flight at once
+EMBED_CHUNK = 256 # Questions per batched query-embedding call
+
+
+def log(message: str):
+    # Node chatter goes to stdout (silenced unless --verbose), our progress to stderr
+    print(message, file=sys.stderr, flush=True)
+
+
+def load_questions(path: str) -> list:
+    questions, seen = [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            item["id"] = str(item.get("id", number))
+            if item["id"] in seen:
+                log(f"⚠️ Skipping duplicate id {item['id']} (line {number})")
+                continue
+            seen.add(item["id"])
+            questions.append(item)
+    return questions
+
+
+def load_done(path: str) -> set:
+    """Ids answered successfully by a previous run."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # Half-written last line of an interrupted run
+            if not record.get("error"):
+                done.add(str(record["id"]))
+    return done
+
+
+def open_output(path: str):
+    """Append mode, starting on a fresh line if an interrupted run left half a record."""
+    needs_newline = False
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    output = open(path, "a", encoding="utf-8", buffering=1)
+    if needs_newline:
+        output.write("\n")
+    return output
+
+
+def embed_questions(questions: list):
+    """Encode every question's query embedding up front, in a few large batches, into the
+    embedding cache. The router and the retriever then get them from the cache."""
+    from embeddings import get_embed_model
+    embed_model = get_embed_model()
+    texts = [item["question"] for item in questions]
+    for start in range(0, len(texts), EMBED_CHUNK):
+        embed_model.get_query_embedding_batch(texts[start:start + EMBED_CHUNK])
+
+
+async def answer(app, item: dict, semaphore: asyncio.Semaphore) -> dict:
+    from memory import ConversationMemory
+    from tracing import tracer
+    async with semaphore:
+        state = {**ConversationMemory().to_state(item["question"]), "next_step": "",
+                 "filters": item.get("filters") or {}}
+        record = {"id": item["id"], "question": item["question"]}
+        started = time.perf_counter()
+        try:
+            with tracer.span("batch.question", id=item["id"]) as span:
+                result = await app.ainvoke(state)
+            record.update(
+                answer=result.get("final_answer", ""),
+                intent=result.get("intent"),
+                sources=sorted({n.node.metadata.get("file_name", "") for n in result.get("retrieved_nodes") or []} - {""}),
+                prompt_tokens=span.attributes.get("prompt_tokens", 0),
+                completion_tokens=span.attributes.get("completion_tokens", 0),
+                trace_id=span.trace_id,
+            )
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["latency_s"] = round(time.perf_counter() - started, 3)
+        return record
+
+
+async def run_batch(questions: list, output, concurrency: int) -> list:
+    from graph import get_app
+    async_app = get_app(async_nodes=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.create_task(answer(async_app, item, semaphore)) for item in questions]
+    records = []
+    for finished in asyncio.as_completed(tasks):
+        record = await finished
+        output.write(json.dumps(record, ensure_ascii=False) + "\n") # Checkpoint: this id is done
+        records.append(record)
+        mark = "❌" if record.get("error") else "✅"
+        log(f"{mark} [{len(records)}/{len(questions)}] {record['id']} ({record['latency_s']:.2f}s)"
+            + (f" {record['error']}" if record.get("error") else ""))
+    return records
+
+
+def print_stats(records: list, wall_s: float):
+    ok = [r for r in records if not r.get("error")]
+    log(f"\n📊 {len(ok)} answered, {len(records) - len(ok)} failed in {wall_s:.1f}s "
+        f"({len(records) / wall_s if wall_s else 0:.2f} questions/s)")
+    if ok:
+        latencies = np.asarray([r["latency_s"] for r in ok])
+        log(f"   latency p50 {np.percentile(latencies, 50):.2f}s, p95 {np.percentile(latencies, 95):.2f}s, "
+            f"p99 {np.percentile(latencies, 99):.2f}s, max {latencies.max():.2f}s")
+        log(f"   tokens in/out {sum(r['prompt_tokens'] for r in ok)}/{sum(r['completion_tokens'] for r in ok)}")
+        intents = {}
+        for r in ok:
+            intents[r["intent"]] = intents.get(r["intent"], 0) + 1
+        log("   intents " + ", ".join(f"{k}: {v}" for k, v in sorted(intents.items(), key=lambda kv: -kv[1])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the RAG agent.")
+    parser.add_argument("input", help="JSONL with one question per line")
+    parser.add_argument("-o", "--output", default=None, help="Results JSONL (default: <input>.answers.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--verbose", action="store_true", help="Show the agents' own output")
+    args = parser.parse_args()
+    output_path = args.output or os.path.splitext(args.input)[0] + ".answers.jsonl"
+
+    questions = load_questions(args.input)
+    done = load_done(output_path)
+    pending = [item for item in questions if item["id"] not in done]
+    log(f"📋 {len(questions)} questions, {len(questions) - len(pending)} already answered in {output_path}, "
+        f"{len(pending)} to go.")
+    if not pending:
+        return
+
+    with contextlib.ExitStack() as quiet:
+        if not args.verbose: # Dropped as it is printed, not buffered for the whole run
+            quiet.enter_context(contextlib.redirect_stdout(quiet.enter_context(open(os.devnull, "w", encoding="utf-8"))))
+        from graph import warm_up
+        warm_up() # One retriever, router and LLM client, shared by every question
+        started = time.perf_counter()
+        embed_questions(pending)
+        log(f"🧮 Embedded {len(pending)} questions in {time.perf_counter() - started:.2f}s.")
+
+        started = time.perf_counter()
+        with open_output(output_path) as output:
+            records = asyncio.run(run_batch(pending, output, args.concurrency))
+    print_stats(records, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
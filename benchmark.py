@@ -0,0 +1,433 @@
+"""
+Offline benchmark: ingestion throughput, search latency, end-to-end agent latency
+and peak memory, with no Groq or LlamaCloud credentials.
+
+ChatGroq, Groq Whisper and LlamaParse are swapped for deterministic stand-ins
+that sleep for a configurable latency. PDF parsing, embeddings, Chroma and BM25
+are the real thing, run over a synthetic corpus in a temporary directory.
+
+    python benchmark.py                          # small + medium, compared to benchmark_baseline.json
+    python benchmark.py --sizes large --llm-latency 0.3
+    python benchmark.py --save-baseline          # record the current numbers as the baseline
+    python benchmark.py --backends torch,onnx    # fp32 PyTorch vs int8 ONNX embeddings, side by side
+
+Each size runs in its own subprocess, so model loads and peak RSS are not shared
+between sizes. After ingesting, one more fresh process measures the cold start a
+user waits through: `import graph` and the first streamed answer (model load,
+opening ./db, compiling the graph). Exits with status 1 if a metric regressed by
+more than --tolerance, and with status 2, comparing nothing, if the baseline was
+recorded with different settings (--queries, the latencies or --seed).
+"""
+import os
+import io
+import sys
+import json
+import time
+import wave
+import random
+import hashlib
+import argparse
+import resource
+import tempfile
+import shutil
+import subprocess
+import contextlib
+from types import SimpleNamespace
+
+BASELINE_PATH = "./benchmark_baseline.json"
+
+# Files per type for each corpus size
+CORPUS_SIZES = {
+    "small": {"pdf": 10, "txt": 10, "audio": 4, "image": 2},
+    "medium": {"pdf": 40, "txt": 40, "audio": 12, "image": 4},
+    "large": {"pdf": 160, "txt": 160, "audio": 40, "image": 10},
+}
+PDF_PAGES = 3
+PARAGRAPHS_PER_PAGE = 4
+QUERIES_PER_RUN = 30
+
+# metric -> True if higher is better; only these are compared with the baseline
+COMPARED_METRICS = {
+    "ingest_docs_per_s": True,
+    "ingest_chunks_per_s": True,
+    "search_p50_ms": False,
+    "search_p95_ms": False,
+    "invoke_p50_ms": False,
+    "invoke_p95_ms": False,
+    "peak_rss_mb": False,
+    "cold_import_s": False,
+    "cold_first_answer_s": False,
+}
+# Arguments that change the numbers; a baseline only compares with runs that used the same ones
+BASELINE_SETTINGS = ("queries", "llm_latency", "whisper_latency", "parse_latency", "seed")
+
+
+# --- Stand-ins for the cloud services ---
+class FakeChatGroq:
+    """Deterministic ChatGroq replacement: sleeps `latency` seconds, then answers from the prompt."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def _respond(self, prompt):
+        from langchain_core.messages import AIMessage
+        from ratelimit import estimate_tokens
+        prompt = str(prompt)
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        content = f"Benchmark answer {digest}: the context mentions {len(prompt)} characters of evidence."
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(content)
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens})
+
+    def invoke(self, prompt, **kwargs):
+        time.sleep(self.latency)
+        return self._respond(prompt)
+
+    async def ainvoke(self, prompt, **kwargs):
+        import asyncio
+        await asyncio.sleep(self.latency)
+        return self._respond(prompt)
+
+
+class FakeGroqClient:
+    """Stands in for `groq.Groq`; only `audio.transcriptions.create` is used by ingest.py."""
+
+    def __init__(self, latency: float):
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self._transcribe))
+        self.latency = latency
+
+    def _transcribe(self, file, response_format="json", **kwargs):
+        time.sleep(self.latency)
+        name, data = file
+        data = data.read() if hasattr(data, "read") else data
+        text = synthetic_text(random.Random(data), 3)
+        if response_format != "verbose_json":
+            return SimpleNamespace(text=text)
+        # Whisper-style timed segments, one per paragraph, 20 s each
+        paragraphs = [p for p in text.split("\n") if p.strip()]
+        segments = [{"start": 20.0 * i, "end": 20.0 * (i + 1), "text": p} for i, p in enumerate(paragraphs)]
+        return SimpleNamespace(text=text, segments=segments)
+
+
+def fake_llama_parse(latency: float):
+    """A LlamaParse class whose parses sleep `latency` seconds and return synthetic markdown."""
+    from llama_index.core import Document
+
+    class FakeLlamaParse:
+        def __init__(self, **kwargs):
+            pass
+
+        def load_data(self, file_path, extra_info=None, **kwargs):
+            time.sleep(latency)
+            with open(file_path, "rb") as f:
+                seed = f.read(64)
+            return [Document(text=synthetic_text(random.Random(seed), 2), metadata=dict(extra_info or {}))]
+
+    return FakeLlamaParse
+
+
+# --- Synthetic corpus ---
+TOPICS = ["apollo", "borealis", "cobalt", "delta", "ember", "fjord", "granite", "helix", "iris", "juniper",
+          "kestrel", "lumen", "meridian", "nimbus", "onyx", "polaris", "quartz", "raven", "sierra", "tundra"]
+PEOPLE = ["Asha Rao", "Ben Okafor", "Chen Wei", "Dana Ruiz", "Elif Kaya", "Farid Haddad", "Greta Lind",
+          "Hiro Sato", "Ines Costa", "Jonas Berg"]
+FILLER = ("the team reviewed quarterly results budget forecast risk register milestones supplier contract "
+          "audit findings training plan hiring pipeline customer feedback roadmap latency throughput "
+          "storage migration compliance energy usage safety incident retrospective").split()
+
+
+def synthetic_text(rng: random.Random, paragraphs: int) -> str:
+    lines = []
+    for _ in range(paragraphs):
+        topic, person = rng.choice(TOPICS), rng.choice(PEOPLE)
+        fact = f"The {topic} initiative was led by {person} in {rng.randint(2015, 2025)}."
+        filler = " ".join(rng.choice(FILLER) for _ in range(rng.randint(60, 120)))
+        lines.append(f"{fact} {filler.capitalize()}.")
+    return "\n\n".join(lines)
+
+
+def build_corpus(data_path: str, size: str, seed: int = 0):
+    """Write the synthetic corpus for `size` into `data_path`. Returns the number of files."""
+    import fitz # PyMuPDF
+    counts = CORPUS_SIZES[size]
+    rng = random.Random(f"{seed}:{size}") # Per-size content, so the embedding cache never spans sizes
+    os.makedirs(data_path, exist_ok=True)
+    for i in range(counts["pdf"]):
+        pdf = fitz.open()
+        for _ in range(PDF_PAGES):
+            page = pdf.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), synthetic_text(rng, PARAGRAPHS_PER_PAGE), fontsize=8)
+        pdf.save(os.path.join(data_path, f"report_{i:04d}.pdf"))
+        pdf.close()
+    for i in range(counts["txt"]):
+        with open(os.path.join(data_path, f"notes_{i:04d}.txt"), "w", encoding="utf-8") as f:
+            f.write(synthetic_text(rng, 6))
+    # Recordings are short noise WAVs that ffmpeg and the wave module can both read; images are
+    # opaque stubs. The fake Whisper / LlamaParse derive their text from the bytes.
+    for i in range(counts["audio"]):
+        with wave.open(os.path.join(data_path, f"meeting_{i:04d}.wav"), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(8000)
+            f.writeframes(rng.randbytes(2 * 8000 * 2)) # 2 s, one upload
+    for i in range(counts["image"]):
+        with open(os.path.join(data_path, f"slide_{i:04d}.png"), "wb") as f:
+            f.write(rng.randbytes(2048))
+    return sum(counts.values())
+
+
+def benchmark_queries(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    templates = ["Who led the {topic} initiative?", "When did the {topic} initiative start?",
+                 "Summarize the {topic} budget forecast.", "What risks were found in {topic}?"]
+    return [rng.choice(templates).format(topic=rng.choice(TOPICS)) for _ in range(count)]
+
+
+# --- Measurement ---
+def percentile_ms(samples, pct: float) -> float:
+    import numpy as np
+    return round(float(np.percentile(samples, pct)) * 1000, 2)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux; children covers the PDF parsing process pool
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+def run_size(size: str, args) -> dict:
+    """Benchmark one corpus size in a fresh working directory (called in a subprocess)."""
+    workdir = tempfile.mkdtemp(prefix=f"rag_bench_{size}_", dir=args.workdir)
+    os.chdir(workdir)
+    n_files = build_corpus("./data", size, seed=args.seed)
+
+    # Dummy credentials get past the key checks; quotas are lifted so only latency is measured
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    os.environ.setdefault("LLAMA_CLOUD_API_KEY", "benchmark")
+    for name in ("GROQ_RPM", "GROQ_TPM", "GROQ_WHISPER_RPM", "LLAMA_PARSE_RPM"):
+        os.environ.setdefault(name, "1000000000")
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        import llm
+        llm._llm = llm.ScheduledLLM(FakeChatGroq(args.llm_latency))
+        import ingest
+        ingest._client = FakeGroqClient(args.whisper_latency)
+        ingest.create_image_parser = fake_llama_parse(args.parse_latency)
+        from embeddings import get_embed_model
+
+        started = time.perf_counter()
+        get_embed_model()
+        model_load_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        ingest.ingest_documents()
+        ingest_s = time.perf_counter() - started
+        # Files that failed to parse or transcribe are in the manifest without documents
+        n_ingested = sum(1 for entry in ingest.load_manifest().values() if entry.get("doc_ids"))
+        cold = run_cold_start(args)
+
+        import tools
+        from graph import get_app
+        app = get_app()
+        from answer_cache import answer_cache
+        from memory import ConversationMemory
+        retriever = tools.get_retriever()
+        retriever.warm_up()
+        n_chunks = retriever._collection.count()
+
+        queries = benchmark_queries(args.queries, seed=args.seed)
+        tools.search_knowledge_base(queries[0]) # Warm-up, not timed
+        search_times = []
+        for query in queries:
+            started = time.perf_counter()
+            tools.search_knowledge_base(query)
+            search_times.append(time.perf_counter() - started)
+
+        invoke_times = []
+        for query in queries:
+            answer_cache.clear() # Measure the full researcher -> reviewer path
+            started = time.perf_counter()
+            app.invoke({**ConversationMemory().to_state(query), "next_step": ""})
+            invoke_times.append(time.perf_counter() - started)
+
+    if n_ingested < n_files:
+        print(f"⚠️  Only {n_ingested} of {n_files} '{size}' files were ingested (run with --verbose to see why).",
+              file=sys.stderr)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "size": size,
+        "files": n_ingested,
+        "chunks": n_chunks,
+        "embed_model_load_s": round(model_load_s, 2),
+        "ingest_s": round(ingest_s, 2),
+        "ingest_docs_per_s": round(n_ingested / ingest_s, 2),
+        "ingest_chunks_per_s": round(n_chunks / ingest_s, 2),
+        "search_p50_ms": percentile_ms(search_times, 50),
+        "search_p95_ms": percentile_ms(search_times, 95),
+        "search_p99_ms": percentile_ms(search_times, 99),
+        "invoke_p50_ms": percentile_ms(invoke_times, 50),
+        "invoke_p95_ms": percentile_ms(invoke_times, 95),
+        "invoke_p99_ms": percentile_ms(invoke_times, 99),
+        "peak_rss_mb": peak_rss_mb(),
+        **cold,
+    }
+
+
+def run_cold_start(args) -> dict:
+    """Run measure_cold_start in a fresh process, on the ./db of the current directory."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_file = f.name
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--cold-start", "--result-file", result_file,
+                        "--llm-latency", str(args.llm_latency), "--seed", str(args.seed)]
+                       + (["--verbose"] if args.verbose else []), check=True)
+        with open(result_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(result_file)
+
+
+def measure_cold_start(args) -> dict:
+    """
+    Seconds to `import graph` (what main.py and the Streamlit app pay before showing
+    anything) and until the first answer has streamed, import included, in this process.
+    """
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        started = time.perf_counter()
+        import graph
+        import_s = time.perf_counter() - started
+        import llm
+        llm._llm = llm.ScheduledLLM(FakeChatGroq(args.llm_latency))
+        from memory import ConversationMemory
+        question = benchmark_queries(1, seed=args.seed + 1)[0]
+        for _ in graph.stream_answer({**ConversationMemory().to_state(question), "next_step": ""}):
+            pass # Lazy loads happen on the way: embedding model, ./db, intent centroids, graph
+        first_answer_s = time.perf_counter() - started
+    return {"cold_import_s": round(import_s, 2), "cold_first_answer_s": round(first_answer_s, 2)}
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Returns a list of regression messages (metrics worse than baseline by more than `tolerance`)."""
+    regressions = []
+    for size, metrics in results.items():
+        base = baseline.get("results", {}).get(size)
+        if not base:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{size}/{metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def settings_mismatch(settings: dict, baseline: dict):
+    """Returns a list of the settings the baseline was recorded with that differ from this run's."""
+    recorded = baseline.get("settings")
+    if recorded is None:
+        return ["(the baseline does not record its settings)"]
+    return [f"{key}: baseline {recorded.get(key)}, now {value}"
+            for key, value in settings.items() if recorded.get(key) != value]
+
+
+def print_report(results: dict, baseline: dict):
+    base_results = baseline.get("results", {}) if baseline else {}
+    for size, metrics in results.items():
+        print(f"\n📊 {size}: {metrics['files']} files, {metrics['chunks']} chunks")
+        for metric, value in metrics.items():
+            if metric in ("size", "files", "chunks"):
+                continue
+            old = base_results.get(size, {}).get(metric)
+            delta = f"  (baseline {old}, {(value - old) / old:+.0%})" if old else ""
+            print(f"   {metric:<22}{value}{delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline RAG benchmark with simulated Groq / LlamaParse.")
+    parser.add_argument("--sizes", default="small,medium", help=f"Comma-separated, from {', '.join(CORPUS_SIZES)}")
+    parser.add_argument("--queries", type=int, default=QUERIES_PER_RUN)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per simulated ChatGroq call")
+    parser.add_argument("--whisper-latency", type=float, default=0.2, help="Seconds per simulated transcription")
+    parser.add_argument("--parse-latency", type=float, default=0.3, help="Seconds per simulated LlamaParse call")
+    parser.add_argument("--backends", default=os.getenv("EMBED_BACKEND", "torch"),
+                        help="Comma-separated embedding backends (torch, onnx); each size runs once per backend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Parent directory for the temporary corpora")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary corpora and databases")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="Show ingest and agent output")
+    parser.add_argument("--run-size", help=argparse.SUPPRESS) # Internal: benchmark one size in this process
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    parser.add_argument("--cold-start", action="store_true", help=argparse.SUPPRESS) # Internal: see measure_cold_start
+    args = parser.parse_args()
+
+    if args.cold_start:
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(measure_cold_start(args), f)
+        return
+
+    if args.run_size:
+        result = run_size(args.run_size, args)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    results = {}
+    script = os.path.abspath(__file__)
+    passthrough = [arg for arg in sys.argv[1:] if arg != "--save-baseline"]
+    for backend in args.backends.split(","):
+        env = {**os.environ, "EMBED_BACKEND": backend}
+        # The exported ONNX model outlives the temporary workdirs
+        env.setdefault("EMBED_ONNX_PATH", os.path.abspath("./onnx_models"))
+        for size in args.sizes.split(","):
+            key = size if backend == "torch" else f"{size}/{backend}" # torch keeps the existing baseline keys
+            print(f"⏱️  Benchmarking '{size}' corpus ({backend} embeddings)...")
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                result_file = f.name
+            try:
+                subprocess.run([sys.executable, script, *passthrough, "--run-size", size, "--result-file", result_file],
+                               check=True, env=env)
+                with open(result_file, "r", encoding="utf-8") as f:
+                    results[key] = json.load(f)
+            finally:
+                os.remove(result_file)
+
+    settings = {k: getattr(args, k) for k in BASELINE_SETTINGS}
+    baseline, mismatch = None, []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        mismatch = settings_mismatch(settings, baseline)
+    print_report(results, None if mismatch else baseline) # Deltas across different settings mean nothing
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+        print(f"\n💾 Baseline saved to {args.baseline}")
+    elif mismatch:
+        print(f"\n⚠️  NOT COMPARED: {args.baseline} was recorded with different settings:")
+        for line in mismatch:
+            print(f"   {line}")
+        print("   Re-run with the baseline's settings, or record a new one with --save-baseline.")
+        sys.exit(2)
+    elif baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against the baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print("\n✅ No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
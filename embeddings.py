@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+EMBED_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower() # "torch" (fp32 PyTorch) or "onnx" (int8 onnxruntime)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32")) # Texts per model forward pass
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embed_cache")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "100000")) # Max cached vectors (~1.5 KB each for bge-small)
+
+KEY_SIZE = 16 # bytes of blake2b digest per entry
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+
+class EmbeddingCache:
+    """
+    Disk-backed LRU cache of embedding vectors, shared by every process using `path`
+    (e.g. ingest.py while the app runs).
+
+    Three memory-mapped arrays of `capacity` rows live in `path`:
+      vectors.f32  float32 [capacity, dim]  the embeddings
+      keys.bin     bytes16 [capacity]       blake2b(model, kind, normalized text)
+      ticks.i64    int64   [capacity]       last-use counter, 0 = free slot
+    plus generation.i64, bumped on every write. Writers hold an exclusive lock on
+    `lock` and readers a shared one. Whenever the generation moved, the key -> slot
+    dict, free list and tick counter are rebuilt from keys.bin and ticks.i64 under
+    that lock, so no two processes ever hand out the same free slot. When the cache
+    is full, the least recently used slots are overwritten.
+    """
+
+    def __init__(self, path: str, dim: int, capacity: int = EMBED_CACHE_SIZE):
+        self.path = path
+        self.dim = dim
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, "lock"), "a+b")
+
+        with self._file_lock(exclusive=True):
+            meta_path = os.path.join(path, "meta.json")
+            meta = {"dim": dim, "capacity": capacity}
+            reuse = False
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    reuse = json.load(f) == meta
+            mode = "r+" if reuse else "w+"
+            self._vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode=mode, shape=(capacity, dim))
+            self._keys = np.memmap(os.path.join(path, "keys.bin"), dtype=f"S{KEY_SIZE}", mode=mode, shape=(capacity,))
+            self._ticks = np.memmap(os.path.join(path, "ticks.i64"), dtype=np.int64, mode=mode, shape=(capacity,))
+            generation_path = os.path.join(path, "generation.i64")
+            self._generation = np.memmap(generation_path, dtype=np.int64, shape=(1,),
+                                         mode="r+" if reuse and os.path.exists(generation_path) else "w+")
+            if not reuse:
+                with open(meta_path, "w", encoding="utf-8") as f:
+                    json.dump(meta, f)
+            self._seen_generation = None
+            self._sync()
+        self.hits = 0
+        self.misses = 0
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        fd = self._lock_file.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        else: # msvcrt only has exclusive locks
+            self._lock_file.seek(0)
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                self._lock_file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def _sync(self):
+        """Rebuild the in-memory view from the shared arrays if another process wrote since. File lock held."""
+        generation = int(self._generation[0])
+        if generation == self._seen_generation:
+            return
+        used = np.flatnonzero((self._ticks > 0) & (self._keys != b""))
+        self._slots = {bytes(self._keys[slot]): int(slot) for slot in used}
+        self._free = sorted(set(range(self.capacity)) - set(used.tolist()), reverse=True)
+        self._tick = int(self._ticks.max()) if len(used) else 0
+        self._seen_generation = generation
+
+    @staticmethod
+    def make_key(model_name: str, kind: str, text: str) -> bytes:
+        normalized = re.sub(r"\s+", " ", text).strip()
+        payload = f"{model_name}\0{kind}\0{normalized}".encode("utf-8")
+        return hashlib.blake2b(payload, digest_size=KEY_SIZE).digest()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[List[float]]]:
+        results = []
+        with self._lock, self._file_lock(exclusive=False):
+            self._sync()
+            for key in keys:
+                key = key.rstrip(b"\0") # What keys.bin gives back (numpy strips trailing NULs)
+                slot = self._slots.get(key)
+                vector = None
+                if slot is not None and bytes(self._keys[slot]) == key:
+                    vector = self._vectors[slot].tolist()
+                    # Ticks only order evictions, so readers may bump them concurrently
+                    self._tick += 1
+                    self._ticks[slot] = self._tick
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]):
+        with self._lock, self._file_lock(exclusive=True):
+            self._sync()
+            keys = [key.rstrip(b"\0") for key in keys]
+            new = [(key, vector) for key, vector in dict(zip(keys, vectors)).items() if key not in self._slots]
+            if not new:
+                return
+            new = new[-self.capacity:]
+            shortfall = len(new) - len(self._free)
+            if shortfall > 0:
+                self._evict(shortfall)
+            slots = [self._free.pop() for _ in new]
+            for slot, (key, vector) in zip(slots, new):
+                self._vectors[slot] = vector
+                self._keys[slot] = key
+                self._tick += 1
+                self._ticks[slot] = self._tick
+                self._slots[key] = slot
+            self._generation[0] += 1
+            self._seen_generation = int(self._generation[0])
+            for array in (self._vectors, self._keys, self._ticks, self._generation):
+                array.flush()
+
+    def _evict(self, count: int):
+        # Least recently used `count` slots; free slots (tick 0) must not be picked
+        ticks = np.where(self._ticks > 0, self._ticks, np.iinfo(np.int64).max)
+        victims = np.argpartition(ticks, count - 1)[:count]
+        for slot in victims.tolist():
+            self._slots.pop(bytes(self._keys[slot]), None)
+            self._keys[slot] = b""
+            self._ticks[slot] = 0
+            self._free.append(slot)
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model with an EmbeddingCache. Only texts that miss the
+    cache reach the model, and they are encoded together in one batch.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _embed(self, kind: str, texts: List[str], compute) -> List[List[float]]:
+        keys = [EmbeddingCache.make_key(self.model_name, kind, text) for text in texts]
+        results = self._cache.get_many(keys)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            computed = compute([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                results[i] = vector
+            self._cache.put_many([keys[i] for i in missing], computed)
+        return results
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed("query", [query], lambda texts: [self._inner.get_query_embedding(texts[0])])[0]
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        """Embed many queries; the ones not cached yet are encoded together in one batch."""
+        return self._embed("query", queries, self._encode_queries)
+
+    def _encode_queries(self, queries: List[str]) -> List[List[float]]:
+        if hasattr(self._inner, "get_query_embedding_batch"): # OnnxEmbedding
+            return self._inner.get_query_embedding_batch(queries)
+        if hasattr(self._inner, "_embed"): # HuggingFaceEmbedding, with its query instruction
+            return self._inner._embed(queries, prompt_name="query")
+        return [self._inner.get_query_embedding(query) for query in queries]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("text", texts, self._inner._get_text_embeddings)
+
+
+def load_base_model(backend: str = EMBED_BACKEND) -> BaseEmbedding:
+    """The uncached bge-small embedder for `backend`. Each backend imports its runtime only when chosen."""
+    if backend == "onnx":
+        from onnx_embedding import OnnxEmbedding
+        return OnnxEmbedding(EMBED_MODEL_NAME, embed_batch_size=EMBED_BATCH_SIZE)
+    if backend == "torch":
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding # Pulls in PyTorch
+        return HuggingFaceEmbedding(model_name=EMBED_MODEL_NAME, embed_batch_size=EMBED_BATCH_SIZE)
+    raise ValueError(f"Unknown EMBED_BACKEND {backend!r} (expected 'torch' or 'onnx')")
+
+
+_embed_model = None
+_embed_model_lock = threading.Lock()
+
+
+def get_embed_model() -> CachedEmbedding:
+    """Return the process-wide (cached) bge-small embedder, loading it on first use."""
+    global _embed_model
+    if _embed_model is None:
+        with _embed_model_lock:
+            if _embed_model is None:
+                print(f"⬇️  Loading local embedding model ({EMBED_MODEL_NAME}, {EMBED_BACKEND})...")
+                inner = load_base_model()
+                dim = len(inner.get_text_embedding("dimension probe"))
+                # Per backend: int8 vectors differ slightly, so they get their own cache
+                cache_dir = os.path.join(EMBED_CACHE_PATH, re.sub(r"[^A-Za-z0-9._-]", "_", inner.model_name))
+                _embed_model = CachedEmbedding(inner, EmbeddingCache(cache_dir, dim))
+    return _embed_model
@@ -0,0 +1,217 @@
+import os
+import re
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+# Normalized `source_type` metadata, set at ingest from the file extension
+SOURCE_TYPES = {
+    "pdf": {".pdf"},
+    "audio": {".mp3", ".wav", ".m4a"},
+    "image": {".jpg", ".jpeg", ".png"},
+    "slides": {".ppt", ".pptx"},
+}
+DEFAULT_SOURCE_TYPE = "document" # Word files, text, markdown, ...
+TAG_PREFIX = "tag_" # Tags are stored as boolean metadata (tag_finance: True), Chroma has no list values
+
+# "... from the audio recordings", "in the slides" -> source type
+_SOURCE_TYPE_WORDS = [
+    (r"audio|recordings?|transcripts?|podcasts?|voice\s+notes?", "audio"),
+    (r"slides?|(?:slide\s+)?decks?|presentations?|powerpoints?|pptx?", "slides"),
+    (r"pdfs?", "pdf"),
+    (r"images?|pictures?|photos?|screenshots?|scans?", "image"),
+]
+# Only an explicit scoping phrase names a source type: a locative preposition, then the source
+# word closing the clause ("in the recording", "from the slides, ...", "across all PDFs").
+# A passing mention ("what did the presentation say about audio quality?", "the quality
+# of audio in our system") leaves the scope unfiltered.
+_CLAUSE_START = (r"about|regarding|that|which|where|when|who|did|does|do|is|are|was|were|"
+                 r"say|says|said|mention|mentions|mentioned|and|or|we|i|you|they")
+_FUNCTION_WORDS = _CLAUSE_START + r"|on|for|to|from|of|with|in|at|by|a|an|the"
+_SCOPE_LEAD = (r"\b(?:in|from|within|across|according\s+to|based\s+on)\s+"
+               r"(?:(?:the|my|our|these|those|this|that|all|each|every)\s+)?"
+               r"(?:(?!(?:" + _FUNCTION_WORDS + r")\b)[\w.'-]+\s+){0,2}?")
+_SCOPE_END = r"\b(?=\s*(?:$|[?.!,;:)])|\s+(?:" + _CLAUSE_START + r")\b)"
+_SOURCE_TYPE_PATTERNS = [
+    (re.compile(_SCOPE_LEAD + r"(?:" + words + r")" + _SCOPE_END, re.IGNORECASE), source_type)
+    for words, source_type in _SOURCE_TYPE_WORDS
+]
+# "in the Q3 deck", "from the onboarding recording" -> the words naming the file
+_SCOPE_NOUNS = (r"deck|slides|report|file|document|doc|pdf|recording|transcript|presentation|"
+                r"spreadsheet|sheet|memo|notes|image|screenshot")
+_NAMED_SOURCE = re.compile(r"\b(?:in|from|of|within|according\s+to)\s+(?:the\s+|my\s+|our\s+)?"
+                           r"(?P<name>(?:[\w.-]+\s+){1,4}?)(?:" + _SCOPE_NOUNS + r")s?\b", re.IGNORECASE)
+_GENERIC_NAME_WORDS = {"the", "a", "an", "my", "our", "this", "that", "these", "those", "all", "same", "other"}
+
+_DATE = r"\d{4}-\d{2}-\d{2}"
+_ADDED = r"\b(?:added|ingested|uploaded|indexed)\s+"
+_ADDED_AFTER = re.compile(_ADDED + r"(?:since|after|from)\s+(?P<date>" + _DATE + r")", re.IGNORECASE)
+_ADDED_BEFORE = re.compile(_ADDED + r"before\s+(?P<date>" + _DATE + r")", re.IGNORECASE)
+_ADDED_WITHIN = re.compile(_ADDED + r"(?:in\s+|within\s+)?(?:the\s+)?(?:last|past)\s+(?P<n>\d+)\s+"
+                           r"(?P<unit>hour|day|week|month)s?\b", re.IGNORECASE)
+_ADDED_RELATIVE = re.compile(_ADDED + r"(?P<when>today|yesterday|this\s+week|this\s+month)\b", re.IGNORECASE)
+_UNIT_SECONDS = {"hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+
+_TAG = re.compile(r"(?:^|\s)#(?P<tag>[\w-]+)|\btagged\s+(?:with\s+|as\s+)?['\"]?(?P<tagged>[\w-]+)", re.IGNORECASE)
+
+
+def source_type(file_path: str) -> str:
+    extension = os.path.splitext(file_path)[1].lower()
+    for name, extensions in SOURCE_TYPES.items():
+        if extension in extensions:
+            return name
+    return DEFAULT_SOURCE_TYPE
+
+
+def normalize_tag(tag: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", tag.lower()).strip("_")
+
+
+def filter_metadata(file_path: str, ingested_at: int, tags: Iterable[str], removed_tags: Iterable[str] = ()) -> dict:
+    """Chunk metadata the filters work on. `removed_tags` are switched off (for re-tagging stored chunks)."""
+    metadata = {"source_type": source_type(file_path), "ingested_at": int(ingested_at)}
+    metadata.update({TAG_PREFIX + tag: False for tag in removed_tags})
+    metadata.update({TAG_PREFIX + tag: True for tag in tags})
+    return metadata
+
+
+@dataclass
+class RetrievalFilter:
+    """
+    Restricts retrieval to some sources. Empty fields do not restrict; the fields
+    that are set must all match (a chunk must carry every tag).
+    """
+    file_names: List[str] = field(default_factory=list)
+    source_types: List[str] = field(default_factory=list)
+    ingested_after: Optional[float] = None # Unix time, inclusive
+    ingested_before: Optional[float] = None # Unix time, exclusive
+    tags: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "RetrievalFilter":
+        data = data or {}
+        return cls(
+            file_names=list(data.get("file_names") or []),
+            source_types=list(data.get("source_types") or []),
+            ingested_after=data.get("ingested_after"),
+            ingested_before=data.get("ingested_before"),
+            tags=[normalize_tag(t) for t in data.get("tags") or []],
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def __bool__(self):
+        return bool(self.file_names or self.source_types or self.tags
+                    or self.ingested_after is not None or self.ingested_before is not None)
+
+    def merged(self, other: "RetrievalFilter") -> "RetrievalFilter":
+        """Fields set here win; the rest come from `other`."""
+        return RetrievalFilter(
+            file_names=self.file_names or other.file_names,
+            source_types=self.source_types or other.source_types,
+            ingested_after=self.ingested_after if self.ingested_after is not None else other.ingested_after,
+            ingested_before=self.ingested_before if self.ingested_before is not None else other.ingested_before,
+            tags=self.tags or other.tags,
+        )
+
+    def to_where(self) -> Optional[dict]:
+        """The filter as a Chroma `where` clause (None if it restricts nothing)."""
+        clauses = []
+        if self.file_names:
+            clauses.append({"file_name": {"$in": list(self.file_names)}})
+        if self.source_types:
+            clauses.append({"source_type": {"$in": list(self.source_types)}})
+        if self.ingested_after is not None:
+            clauses.append({"ingested_at": {"$gte": int(self.ingested_after)}})
+        if self.ingested_before is not None:
+            clauses.append({"ingested_at": {"$lt": int(self.ingested_before)}})
+        clauses.extend({TAG_PREFIX + tag: True} for tag in self.tags)
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def describe(self) -> str:
+        parts = []
+        if self.file_names:
+            parts.append("files " + ", ".join(self.file_names))
+        if self.source_types:
+            parts.append(" / ".join(self.source_types))
+        if self.ingested_after is not None:
+            parts.append(f"added since {datetime.fromtimestamp(self.ingested_after):%Y-%m-%d %H:%M}")
+        if self.ingested_before is not None:
+            parts.append(f"added before {datetime.fromtimestamp(self.ingested_before):%Y-%m-%d %H:%M}")
+        if self.tags:
+            parts.append("tags " + ", ".join(f"#{t}" for t in self.tags))
+        return "; ".join(parts)
+
+
+def _name_words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def match_file_names(question: str, known_files: Iterable[str]) -> List[str]:
+    """
+    Known file names the question points at: by full name ("q3_review.pptx"), by
+    its stem ("q3 review"), or by a scoped phrase whose words all occur in the
+    name ("in the Q3 deck").
+    """
+    lowered = question.lower()
+    question_words = " ".join(_name_words(question))
+    named = [[w for w in _name_words(m.group("name")) if w not in _GENERIC_NAME_WORDS]
+             for m in _NAMED_SOURCE.finditer(question)]
+    named = [words for words in named if words]
+    matches = []
+    for file_name in dict.fromkeys(os.path.basename(f) for f in known_files):
+        stem_words = _name_words(os.path.splitext(file_name)[0])
+        if not stem_words:
+            continue
+        if (file_name.lower() in lowered
+                or (len(stem_words) > 1 and f" {' '.join(stem_words)} " in f" {question_words} ")
+                or any(set(words) <= set(stem_words) for words in named)):
+            matches.append(file_name)
+    return matches
+
+
+def _start_of_day(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def extract_filters(question: str, known_files: Iterable[str] = (), now: float = None) -> RetrievalFilter:
+    """
+    Scope that the question itself asks for: named files, source types ("from the
+    audio recordings"), ingestion dates ("added in the last 7 days", "added since
+    2024-05-01") and tags ("#finance", "tagged legal").
+    """
+    now = time.time() if now is None else now
+    scope = RetrievalFilter(file_names=match_file_names(question, known_files))
+    if not scope.file_names: # A named file is more precise than its type ("the Q3 deck" may be a PDF)
+        scope.source_types = [t for pattern, t in _SOURCE_TYPE_PATTERNS if pattern.search(question)]
+
+    match = _ADDED_AFTER.search(question)
+    if match:
+        scope.ingested_after = datetime.strptime(match.group("date"), "%Y-%m-%d").timestamp()
+    match = _ADDED_BEFORE.search(question)
+    if match:
+        scope.ingested_before = datetime.strptime(match.group("date"), "%Y-%m-%d").timestamp()
+    match = _ADDED_WITHIN.search(question)
+    if match:
+        scope.ingested_after = now - int(match.group("n")) * _UNIT_SECONDS[match.group("unit").lower()]
+    match = _ADDED_RELATIVE.search(question)
+    if match:
+        today = _start_of_day(datetime.fromtimestamp(now))
+        when = re.sub(r"\s+", " ", match.group("when").lower())
+        if when == "today":
+            scope.ingested_after = today.timestamp()
+        elif when == "yesterday":
+            scope.ingested_after = (today - timedelta(days=1)).timestamp()
+            scope.ingested_before = today.timestamp()
+        elif when == "this week":
+            scope.ingested_after = (today - timedelta(days=today.weekday())).timestamp()
+        else:
+            scope.ingested_after = today.replace(day=1).timestamp()
+
+    tags = (normalize_tag(m.group("tag") or m.group("tagged")) for m in _TAG.finditer(question))
+    scope.tags = list(dict.fromkeys(tag for tag in tags if tag and not tag.isdigit())) # "issue #1" is no tag
+    return scope
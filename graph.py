@@ -1,215 +1,697 @@
-import os
-from dotenv import load_dotenv
-from typing import TypedDict, List, Union
-from langgraph.graph import StateGraph, END
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_groq import ChatGroq
-from tools import search_knowledge_base
-
-# 1. Force Load Environment Variables
-load_dotenv()
-api_key = os.getenv("GROQ_API_KEY")
-
-if not api_key:
-    raise ValueError("❌ CRITICAL ERROR: GROQ_API_KEY is missing from .env file!")
-
-# 2. Define State
-class AgentState(TypedDict):
-    messages: List[Union[HumanMessage, AIMessage, SystemMessage]]
-    next_step: str
-
-# 3. Initialize LLM (Groq)
-llm = ChatGroq(
-    model="llama-3.1-8b-instant", 
-    temperature=0, 
-    api_key=api_key 
-)
-
-# 4. Define Nodes
-def supervisor_node(state: AgentState):
-    messages = state['messages']
-    last_user_msg = messages[-1].content.lower()
-    
-    if "visualize" in last_user_msg or "flowchart" in last_user_msg:
-        return {"next_step": "VISUALIZER"}
-    elif "don't understand" in last_user_msg:
-        return {"next_step": "VISUALIZER"}
-    
-    # If we have an AI message (from Researcher), we are done
-    if isinstance(messages[-1], AIMessage):
-        return {"next_step": "FINISH"}
-
-    return {"next_step": "RESEARCHER"}
-
-def researcher_node(state: AgentState):
-    last_message = state['messages'][-1].content
-    print(f"🕵️ Researcher is looking up: {last_message}")
-    context = search_knowledge_base(last_message) # Renamed 'result' to 'context' for clarity with new prompt
-
-    # Assuming llm_provider is set globally or passed, for this example, we'll assume it's "Groq"
-    # and that the global 'llm' object is the one to use for synthesis.
-    # If 'llm_provider' is not defined, this block will not execute.
-    llm_provider = "Groq" # Placeholder, adjust as needed based on actual setup
-
-    if llm and llm_provider != "Mock":
-        print(f"Synthesizing answer using {llm_provider}...")
-        
-        # Enhanced Prompt for Synthesis (Walkthrough aligned)
-        prompt = (
-            f"You are an intelligent expert. User asks: '{last_message}'\n\n"
-            f"Here is the retrieved context from multiple sources (PDFs, Audio, Images):\n"
-            f"---------------------\n{context}\n---------------------\n\n"
-            f"Check the User's Intent and Apply the Correct Mode:\n"
-            f"1. **Compare Mode**: If user asks to 'Compare' A vs B, explicitly list Differences and Similarities.\n"
-            f"2. **Formula Mode**: If identifying formulas, list them as '[Doc Name]: Formula'.\n"
-            f"3. **Adaptive Mode**: \n"
-            f"   - If user says 'Explain in detail', provide a multi-paragraph deep dive.\n"
-            f"   - If user says 'Summarize', provide bullet points.\n"
-            f"4. **Concise Mode**: For general queries, be brief and focused. Read everything but report only key takeaways.\n"
-            f"5. **Holistic Mode**: Synthesize facts into ONE narrative. Avoid repetitive lists.\n"
-            f"6. **Attribution Mode**: If user asks 'Who wrote...', 'Which author...', or 'Find source...', analyze content AND filenames to identify the creator involved with the specific concept (e.g., 'Love').\n\n"
-            f"Answer:"
-        )
-
-        try:
-            # Handle different invoke patterns if necessary, but LangChain/Groq/Ollama usually support invoke or similar
-            if llm_provider == "Groq":
-                 # Using the global 'llm' which is ChatGroq
-                 res = llm.invoke(prompt) # ChatGroq's invoke method
-                 content = res.content
-            # The original snippet had specific Groq/Ollama client calls,
-            # but since 'llm' is already a LangChain ChatGroq, we use its invoke.
-            # For other providers, you'd need to initialize 'llm' differently or add more logic.
-            elif llm_provider == "Ollama":
-                # This would require 'llm' to be an Ollama client or a LangChain Ollama model
-                # For now, assuming 'llm' is ChatGroq, this path won't be taken.
-                # If 'llm' was an Ollama client, it might look like:
-                # res = llm.generate(model='mistral', prompt=prompt, stream=False)
-                # content = res['response'] if isinstance(res, dict) else str(res)
-                res = llm.invoke(prompt) # Fallback to generic invoke if 'llm' is a LangChain model
-                content = res.content if hasattr(res, 'content') else str(res)
-            else: # OpenAI or LangChain wrapper
-                res = llm.invoke(prompt)
-                content = res.content if hasattr(res, 'content') else str(res)
-                
-            # Pass Context + Draft to Reviewer
-            combined_content = f"CONTEXT_BLOCK:\n{context}\n\n---DRAFT_BLOCK---\n{content}"
-            response_msg = AIMessage(content=combined_content)
-        except Exception as e:
-            print(f"LLM Synthesis failed: {e}")
-            if "429" in str(e):
-                error_msg = "⚠️ API Rate Limit Hit (Groq Free Tier). Please wait a moment and try again."
-            else:
-                error_msg = f"(LLM Synthesis Failed: {e})"
-            
-            response_msg = AIMessage(content=f"Found Facts: {context}\n\n{error_msg}")
-    else:
-        response_msg = AIMessage(content=f"Found Facts: {context}")
-        
-    return {"messages": [response_msg]}
-
-def reviewer_node(state: AgentState):
-    messages = state['messages']
-    user_query = messages[-2].content if len(messages) > 1 else "Unknown"
-    # Parse Context vs Draft
-    content = messages[-1].content
-    if "CONTEXT_BLOCK:" in content and "---DRAFT_BLOCK---" in content:
-        try:
-            parts = content.split("---DRAFT_BLOCK---")
-            context_part = parts[0].replace("CONTEXT_BLOCK:", "").strip()
-            draft_part = parts[1].strip()
-        except:
-            context_part = "UNKNOWN"
-            draft_part = content
-    else:
-        context_part = "UNKNOWN"
-        draft_part = content
-
-    print("🧐 Reviewer is critiquing the draft...")
-
-    prompt = f"""
-    You are a Senior Editor and Fact-Checker.
-    
-    User Query: {user_query}
-    
-    Original Retrieved Context (Truth):
-    {context_part}
-    
-    Researcher's Draft Answer:
-    {draft_part}
-    
-    Task:
-    1. Verify that the Draft is fully supported by the Context. 
-    2. **HALLUCINATION CHECK**: If the draft contains claims NOT in the context, remove them or correct them.
-    3. If the Context is empty or irrelevant, admitting "I don't know" is better than hallucinating.
-    3. If the Context is empty or irrelevant, admitting "I don't know" is better than hallucinating.
-    4. Refine the tone to be professional and clear.
-    5. **ATTRIBUTION CHECK**: Ensure authors/sources are correctly linked to their concepts/poems.
-    
-    Output the Final Polished Answer:
-    """
-    
-    if llm:
-        try:
-            response = llm.invoke(prompt)
-            return {"messages": [AIMessage(content=response.content)]}
-        except Exception as e:
-             print(f"Reviewer failed: {e}")
-             if "429" in str(e):
-                 # If reviewer hits 429, just return the Draft with a warning note
-                 return {"messages": [AIMessage(content=draft_part + "\n\n(Review skipped due to Rate Limit 429)")]}
-             return {"messages": [AIMessage(content=draft_part)]} # Fallback to draft
-    else:
-        return {"messages": [AIMessage(content=draft_part)]}
-
-def visualizer_node(state: AgentState):
-    context = state['messages'][-2].content if len(state['messages']) > 1 else state['messages'][-1].content
-    print("🎨 Visualizer is drawing a flowchart...")
-    prompt = f"""
-    Based on this context: {context}
-    
-    User Query: {state['messages'][-1].content}
-    
-    Task:
-    1. If the user said "I don't understand", first provide a **Key Points** summary (bullet points) to clarify the concept.
-    2. Then, create a MERMAID.JS flowchart to visualize it.
-    
-    Output Format:
-    [Key Points explanation if needed]
-    
-    ```mermaid
-    graph TD
-    ...code...
-    ```
-    """
-    try:
-        response = llm.invoke(prompt)
-        # We return the full content now (Text + Code) so the user sees the clarification.
-        return {"messages": [AIMessage(content=response.content)]}
-    except Exception as e:
-        print(f"Visualizer failed: {e}")
-        if "429" in str(e):
-             return {"messages": [AIMessage(content="(Visualization skipped due to API Rate Limit. Please try again later.)")]}
-        return {"messages": [AIMessage(content="(Visualization Failed)")]}
-
-
-# 5. Build Graph
-workflow = StateGraph(AgentState)
-workflow.add_node("supervisor", supervisor_node)
-workflow.add_node("researcher", researcher_node)
-workflow.add_node("reviewer", reviewer_node)
-workflow.add_node("visualizer", visualizer_node)
-workflow.set_entry_point("supervisor")
-
-def route_logic(state):
-    return state['next_step']
-
-workflow.add_conditional_edges("supervisor", route_logic, {
-    "RESEARCHER": "researcher",
-    "VISUALIZER": "visualizer",
-    "FINISH": END
-})
-workflow.add_edge("researcher", "reviewer")
-workflow.add_edge("reviewer", "supervisor")
-workflow.add_edge("visualizer", END)
-app = workflow.compile()
\ No newline at end of file
+import os
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from typing import TypedDict, List, Annotated
+from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
+from langgraph.config import get_config, get_stream_writer
+from langchain_core.messages import AIMessage, AIMessageChunk, AnyMessage
+from llm import get_llm
+from ratelimit import is_rate_limit_error
+from tools import get_retriever, format_source, CONTEXT_TOKEN_BUDGET, DB_PATH
+from answer_cache import answer_cache, fingerprint_chunks, fingerprint_conversation
+from memory import render_transcript
+from tracing import tracer, traced, annotate
+from grounding import check_grounding, apply_corrections, GROUNDING_PARTIAL_MIN
+from router import get_router, extract_entities
+from filters import RetrievalFilter, extract_filters
+
+# 1. Force Load Environment Variables
+# (GROQ_API_KEY is checked when the LLM client is first needed, see llm.get_llm)
+load_dotenv()
+WARM_UP = os.getenv("WARM_UP", "background") # Load models at startup: background, blocking or off
+
+# 2. Define State
+class AgentState(TypedDict, total=False):
+    messages: Annotated[List[AnyMessage], add_messages] # Memory window + this turn; nodes append their reply
+    summary: str # Rolling summary of the turns that left the window (see memory.py)
+    question: str # The current user question
+    intent: str # Set by the supervisor's router: lookup, summarize, compare, attribution, visualize, chit_chat
+    next_step: str
+    retrieved_nodes: list # NodeWithScore chunks packed into `context`, with their scores
+    context: str # Retrieved context handed from the researcher to the reviewer
+    draft: str # Researcher's draft answer
+    draft_failed: bool # Synthesis failed: the draft is the raw context (plus an error note), not an answer
+    final_answer: str # Reviewed (or cached / visualized) answer for this turn
+    cache_key: dict # Query embedding + chunk and conversation fingerprints + KB version, set by the researcher
+    filters: dict # Explicit retrieval scope (RetrievalFilter fields), on top of what the question asks for
+
+def report_progress(message: str):
+    """Emit a status line as a progress event when the graph is streamed, else print it."""
+    try:
+        streaming = get_config().get("configurable", {}).get("stream_progress", False)
+    except RuntimeError:
+        streaming = False # Called outside a graph run
+    if streaming:
+        get_stream_writer()(message)
+    else:
+        print(message)
+
+# 3. Define Nodes
+# Each LLM node is split into prompt building and result handling, shared by the
+# sync node (used by `app`) and its async twin (used by `async_app`).
+def current_question(state: AgentState) -> str:
+    return state.get('question') or state['messages'][-1].content
+
+def conversation_so_far(state: AgentState) -> str:
+    """Rolling summary plus the verbatim window before the current question, for prompts."""
+    parts = []
+    if state.get('summary'):
+        parts.append(f"Summary of earlier turns: {state['summary']}")
+    if len(state['messages']) > 1:
+        parts.append(render_transcript(state['messages'][:-1]))
+    return "\n".join(parts)
+
+# Graph path of each intent (see router.py)
+INTENT_ROUTES = {
+    "lookup": "LOOKUP", # Retrieval + one LLM call, no review
+    "summarize": "RESEARCHER", # Researcher -> reviewer
+    "attribution": "RESEARCHER",
+    "compare": "COMPARE", # One retrieval per entity, in parallel, then reviewer
+    "visualize": "VISUALIZER",
+    "chit_chat": "CHAT", # One LLM call, no retrieval
+}
+
+@traced("supervisor")
+def supervisor_node(state: AgentState):
+    # Once this turn has an answer (reviewed or cached), we are done
+    if state.get('final_answer'):
+        return {"next_step": "FINISH"}
+
+    question = current_question(state)
+    try:
+        intent, score = get_router().classify(question)
+    except Exception as e:
+        print(f"Router failed, taking the research path: {e}")
+        intent, score = "summarize", 0.0
+    annotate(intent=intent, intent_score=round(score, 3))
+    report_progress(f"🧭 Routed as '{intent}'.")
+    return {"intent": intent, "next_step": INTENT_ROUTES[intent]}
+
+def scoped_retrieve(state: AgentState, query: str, token_budget: int = CONTEXT_TOKEN_BUDGET, scope_text: str = None):
+    """
+    Retrieve `query` within the state's explicit filters plus the scope that
+    `scope_text` (default: the query) names: files, source types, dates, tags (see
+    filters.py). If an inferred scope finds nothing, it was probably misread, so
+    the search is widened again.
+    """
+    retriever = get_retriever()
+    explicit = RetrievalFilter.from_dict(state.get('filters'))
+    scope = explicit.merged(extract_filters(scope_text or query, retriever.known_files()))
+    retrieval = retriever.retrieve(query, token_budget, scope)
+    if not retrieval.nodes and scope != explicit:
+        retrieval = retriever.retrieve(query, token_budget, explicit)
+    return retrieval
+
+def research_update(state: AgentState, context: str, nodes: list, query_embedding, kb_version, scopes: list = ()):
+    """State update for retrieved context, checking the answer cache. Returns (update, cache hit)."""
+    node_ids = [n.node.node_id for n in nodes]
+    scoped = f" (only {' | '.join(scopes)})" if scopes else ""
+    report_progress(f"🔎 Retrieved {len(node_ids)} chunks{scoped}.")
+    annotate(chunks=len(node_ids), context_bytes=len(context.encode("utf-8")))
+
+    # Semantic answer cache: same evidence + near-identical question -> reuse the reviewed answer.
+    # The prompts also carry the conversation, and the intent picks the answer's format, so both are in the key.
+    cache_key = {
+        "query_embedding": query_embedding,
+        "chunk_fingerprint": fingerprint_chunks(node_ids),
+        "kb_version": kb_version,
+        "conversation_fingerprint": fingerprint_conversation(conversation_so_far(state), state.get('intent', "")),
+    }
+    update = {"context": context, "retrieved_nodes": nodes, "cache_key": cache_key}
+    cached_answer = answer_cache.lookup(**cache_key)
+    if cached_answer is not None:
+        report_progress("⚡ Answer cache hit, skipping synthesis and review.")
+        annotate(cache_hit=True)
+        update.update(answer_update(cached_answer), next_step="CACHED")
+        return update, True
+    return update, False
+
+def start_research(state: AgentState):
+    """Retrieve context and check the answer cache. Returns (state update, cache hit)."""
+    question = current_question(state)
+    print(f"🕵️ Researcher is looking up: {question}")
+    try:
+        retrieval = scoped_retrieve(state, question)
+    except Exception as e:
+        return {"context": f"(Error during retrieval): {e}", "retrieved_nodes": [], "cache_key": None}, False
+    scopes = [retrieval.filters.describe()] if retrieval.filters else []
+    return research_update(state, retrieval.context, retrieval.nodes, retrieval.query_embedding, retrieval.kb_version,
+                           scopes)
+
+def compare_retrievals(state: AgentState, retrievals: list):
+    """Merge per-entity retrievals into one labelled context. Returns (state update, cache hit)."""
+    sections, nodes = [], {}
+    for entity, retrieval in retrievals:
+        sections.append(f"### {entity}\n{retrieval.context}")
+        for scored in retrieval.nodes:
+            nodes.setdefault(scored.node.node_id, scored)
+    # Cache under the whole question (the router already embedded it, so this is a cache hit)
+    from embeddings import get_embed_model
+    query_embedding = get_embed_model().get_query_embedding(current_question(state))
+    scopes = [f"{entity}: {r.filters.describe()}" for entity, r in retrievals if r.filters]
+    return research_update(state, "\n\n".join(sections), list(nodes.values()), query_embedding, retrievals[0][1].kb_version,
+                           scopes)
+
+def compare_entities(state: AgentState):
+    question = current_question(state)
+    entities = extract_entities(question) or [question]
+    print(f"⚖️ Comparer is looking up: {', '.join(entities)}")
+    report_progress(f"⚖️ Retrieving {len(entities)} sides in parallel...")
+    return entities, CONTEXT_TOKEN_BUDGET // len(entities) # Same total context as a single retrieval
+
+def start_comparison(state: AgentState):
+    """Retrieve each compared entity in parallel threads. Returns (state update, cache hit)."""
+    entities, budget = compare_entities(state)
+    try:
+        with ThreadPoolExecutor(max_workers=len(entities)) as pool:
+            # copy_context() keeps the retrieval spans under this node's span. Each side is
+            # scoped on its own, e.g. "the audio recording" vs "the Q3 deck".
+            futures = [pool.submit(contextvars.copy_context().run, scoped_retrieve, state, entity, budget,
+                                   f"from the {entity}") for entity in entities]
+            retrievals = list(zip(entities, [future.result() for future in futures]))
+    except Exception as e:
+        return {"context": f"(Error during retrieval): {e}", "retrieved_nodes": [], "cache_key": None}, False
+    return compare_retrievals(state, retrievals)
+
+async def astart_comparison(state: AgentState):
+    entities, budget = compare_entities(state)
+    try:
+        results = await asyncio.gather(*(asyncio.to_thread(scoped_retrieve, state, entity, budget, f"from the {entity}")
+                                         for entity in entities))
+    except Exception as e:
+        return {"context": f"(Error during retrieval): {e}", "retrieved_nodes": [], "cache_key": None}, False
+    return await asyncio.to_thread(compare_retrievals, state, list(zip(entities, results)))
+
+def synthesis_prompt(last_message: str, context: str, conversation: str = "") -> str:
+    # Enhanced Prompt for Synthesis (Walkthrough aligned)
+    history = f"Conversation so far:\n{conversation}\n\n" if conversation else ""
+    return (
+        f"You are an intelligent expert. User asks: '{last_message}'\n\n"
+        f"{history}"
+        f"Here is the retrieved context from multiple sources (PDFs, Audio, Images):\n"
+        f"---------------------\n{context}\n---------------------\n\n"
+        f"Check the User's Intent and Apply the Correct Mode:\n"
+        f"1. **Compare Mode**: If user asks to 'Compare' A vs B, explicitly list Differences and Similarities.\n"
+        f"2. **Formula Mode**: If identifying formulas, list them as '[Doc Name]: Formula'.\n"
+        f"3. **Adaptive Mode**: \n"
+        f"   - If user says 'Explain in detail', provide a multi-paragraph deep dive.\n"
+        f"   - If user says 'Summarize', provide bullet points.\n"
+        f"4. **Concise Mode**: For general queries, be brief and focused. Read everything but report only key takeaways.\n"
+        f"5. **Holistic Mode**: Synthesize facts into ONE narrative. Avoid repetitive lists.\n"
+        f"6. **Attribution Mode**: If user asks 'Who wrote...', 'Which author...', or 'Find source...', analyze content AND filenames to identify the creator involved with the specific concept (e.g., 'Love').\n"
+        f"7. **Timestamps**: For facts from a recording, cite its time range from the source label, e.g. '(meeting.mp3, 00:12:30–00:13:30)'.\n\n"
+        f"Answer:"
+    )
+
+def research_prompt(state: AgentState, update: dict) -> str:
+    return synthesis_prompt(current_question(state), update['context'], conversation_so_far(state))
+
+def finish_research(update: dict, content: str = None, error: Exception = None):
+    context = update['context']
+    if error is not None:
+        print(f"LLM Synthesis failed: {error}")
+        if is_rate_limit_error(error):
+            error_msg = "⚠️ API Rate Limit Hit (Groq Free Tier). Please wait a moment and try again."
+        else:
+            error_msg = f"(LLM Synthesis Failed: {error})"
+        draft = f"Found Facts: {context}\n\n{error_msg}"
+    elif content is not None:
+        draft = content
+    else:
+        draft = f"Found Facts: {context}"
+    # Context and draft travel to the reviewer as their own state fields
+    return {**update, "draft": draft, "draft_failed": content is None, "next_step": "REVIEWER"}
+
+def synthesize(state: AgentState, update: dict):
+    print("Synthesizing answer using Groq...")
+    try:
+        res = get_llm().invoke(research_prompt(state, update))
+        report_progress("📝 Draft ready.")
+        return finish_research(update, content=res.content)
+    except Exception as e:
+        return finish_research(update, error=e)
+
+async def asynthesize(state: AgentState, update: dict):
+    print("Synthesizing answer using Groq...")
+    try:
+        res = await get_llm().ainvoke(research_prompt(state, update))
+        report_progress("📝 Draft ready.")
+        return finish_research(update, content=res.content)
+    except Exception as e:
+        return finish_research(update, error=e)
+
+@traced("researcher")
+def researcher_node(state: AgentState):
+    update, cached = start_research(state)
+    return update if cached else synthesize(state, update)
+
+@traced("researcher")
+async def aresearcher_node(state: AgentState):
+    # Retrieval is CPU/disk bound, keep it off the event loop
+    update, cached = await asyncio.to_thread(start_research, state)
+    return update if cached else await asynthesize(state, update)
+
+@traced("comparer")
+def comparer_node(state: AgentState):
+    update, cached = start_comparison(state)
+    return update if cached else synthesize(state, update)
+
+@traced("comparer")
+async def acomparer_node(state: AgentState):
+    update, cached = await astart_comparison(state)
+    return update if cached else await asynthesize(state, update)
+
+def finish_lookup(update: dict, content: str = None, error: Exception = None):
+    """Fast path: the synthesized answer is final (no reviewer call)."""
+    result = finish_research(update, content=content, error=error)
+    if content is not None and update.get('cache_key'):
+        answer_cache.store(answer=content, **update['cache_key'])
+    return {**result, **answer_update(result['draft'])}
+
+@traced("lookup")
+def lookup_node(state: AgentState):
+    update, cached = start_research(state)
+    if cached:
+        return update
+    try:
+        res = get_llm().invoke(research_prompt(state, update))
+        return finish_lookup(update, content=res.content)
+    except Exception as e:
+        return finish_lookup(update, error=e)
+
+@traced("lookup")
+async def alookup_node(state: AgentState):
+    update, cached = await asyncio.to_thread(start_research, state)
+    if cached:
+        return update
+    try:
+        res = await get_llm().ainvoke(research_prompt(state, update))
+        return finish_lookup(update, content=res.content)
+    except Exception as e:
+        return finish_lookup(update, error=e)
+
+def chat_prompt(state: AgentState) -> str:
+    conversation = conversation_so_far(state)
+    history = f"Conversation so far:\n{conversation}\n\n" if conversation else ""
+    return (
+        f"You are the friendly assistant of a document question-answering system "
+        f"(PDFs, Audio, Images and slides in the user's knowledge base).\n\n"
+        f"{history}"
+        f"User says: '{current_question(state)}'\n\n"
+        f"Reply briefly and naturally. Do not state facts about the documents; if the user wants "
+        f"information from them, invite them to ask their question.\n\nReply:"
+    )
+
+def finish_chat(content: str = None, error: Exception = None):
+    if error is not None:
+        print(f"Chat reply failed: {error}")
+        return answer_update("Hello! Ask me anything about your documents.")
+    return answer_update(content)
+
+@traced("chat")
+def chat_node(state: AgentState):
+    try:
+        return finish_chat(content=get_llm().invoke(chat_prompt(state)).content)
+    except Exception as e:
+        return finish_chat(error=e)
+
+@traced("chat")
+async def achat_node(state: AgentState):
+    try:
+        response = await get_llm().ainvoke(chat_prompt(state))
+        return finish_chat(content=response.content)
+    except Exception as e:
+        return finish_chat(error=e)
+
+def review_prompt(state: AgentState) -> str:
+    report_progress("🧐 Reviewer is critiquing the draft...")
+
+    prompt = f"""
+    You are a Senior Editor and Fact-Checker.
+    
+    User Query: {current_question(state)}
+    
+    Original Retrieved Context (Truth):
+    {state.get('context') or "UNKNOWN"}
+    
+    Researcher's Draft Answer:
+    {state.get('draft', "")}
+    
+    Task:
+    1. Verify that the Draft is fully supported by the Context. 
+    2. **HALLUCINATION CHECK**: If the draft contains claims NOT in the context, remove them or correct them.
+    3. If the Context is empty or irrelevant, admitting "I don't know" is better than hallucinating.
+    3. If the Context is empty or irrelevant, admitting "I don't know" is better than hallucinating.
+    4. Refine the tone to be professional and clear.
+    5. **ATTRIBUTION CHECK**: Ensure authors/sources are correctly linked to their concepts/poems.
+    
+    Output the Final Polished Answer:
+    """
+    return prompt
+
+def answer_update(answer: str) -> dict:
+    """State update recording `answer` as this turn's final answer."""
+    return {"final_answer": answer, "messages": [AIMessage(content=answer)]}
+
+def finish_review(state: AgentState, content: str = None, error: Exception = None):
+    draft = state.get('draft', "")
+    if error is not None:
+        print(f"Reviewer failed: {error}")
+        if is_rate_limit_error(error):
+            # If reviewer hits 429, just return the Draft with a warning note
+            return answer_update(draft + "\n\n(Review skipped due to Rate Limit 429)")
+        return answer_update(draft) # Fallback to draft
+    if content is None:
+        return answer_update(draft)
+    if state.get('cache_key'):
+        answer_cache.store(answer=content, **state['cache_key'])
+    return answer_update(content)
+
+def check_draft(state: AgentState):
+    """Local (CPU) grounding check of the draft. Returns a GroundingReport, or None if it can't run."""
+    if not state.get('retrieved_nodes') or not state.get('draft'):
+        return None
+    try:
+        report = check_grounding(state['draft'], state['retrieved_nodes'])
+    except Exception as e:
+        print(f"Grounding check failed, using the LLM reviewer: {e}")
+        return None
+    annotate(grounding_min_score=round(report.min_score, 3), unsupported_sentences=len(report.unsupported))
+    return report
+
+def repair_prompt(state: AgentState, report) -> str:
+    """Reviewer prompt with only the unsupported sentences and the chunks closest to them."""
+    report_progress(f"🧐 Reviewer is checking {len(report.unsupported)} unsupported sentence(s)...")
+    nodes = state['retrieved_nodes']
+    from llama_index.core.schema import MetadataMode
+    evidence_ids = list(dict.fromkeys(grade.evidence for grade in report.unsupported))
+    evidence = "\n\n".join(
+        f"[Source: {format_source(nodes[i].node)}]\n{nodes[i].node.get_content(metadata_mode=MetadataMode.NONE)}"
+        for i in evidence_ids)
+    sentences = "\n".join(f"{n}. {grade.text}" for n, grade in enumerate(report.unsupported, start=1))
+    prompt = f"""
+    You are a Senior Editor and Fact-Checker.
+    
+    User Query: {current_question(state)}
+    
+    Original Retrieved Context (Truth):
+    {evidence}
+    
+    These sentences of the Researcher's Draft Answer could not be matched to the Context:
+    {sentences}
+    
+    Task:
+    For each numbered sentence, output one line starting with the same number, containing either
+    the sentence corrected so that it is fully supported by the Context (keep names, numbers and
+    attributions exact), or DELETE if the Context does not support it. Output nothing else.
+    """
+    return prompt
+
+def review_request(state: AgentState):
+    """
+    Decide how much reviewing the draft needs. Returns (prompt, report, update):
+    `update` is set when no LLM call is needed (the draft is grounded, or synthesis failed), and
+    `report` when only its unsupported sentences are sent (else a full review).
+    """
+    if state.get('draft_failed'):
+        # Raw context plus an error note: nothing to ground or repair, and never cached
+        return None, None, answer_update(state['draft'])
+    report = check_draft(state)
+    if report is not None and report.grounded:
+        report_progress("✅ Draft is grounded in the context, skipping the reviewer.")
+        return None, None, finish_review(state, content=state['draft'])
+    if report is not None and report.supported_share >= GROUNDING_PARTIAL_MIN:
+        return repair_prompt(state, report), report, None
+    return review_prompt(state), None, None
+
+# Sentence corrections are spliced into the draft, so their tokens must not stream as the answer
+NO_STREAM = {"tags": ["nostream"]}
+
+def finish_repair(state: AgentState, report, content: str):
+    answer = apply_corrections(state['draft'], report.unsupported, content)
+    return finish_review(state, content=answer or "I don't know, the documents do not support an answer.")
+
+@traced("reviewer")
+def reviewer_node(state: AgentState):
+    prompt, report, update = review_request(state)
+    if update:
+        return update
+    try:
+        if report:
+            response = get_llm().invoke(prompt, config=NO_STREAM)
+            return finish_repair(state, report, response.content)
+        response = get_llm().invoke(prompt)
+        return finish_review(state, content=response.content)
+    except Exception as e:
+        return finish_review(state, error=e)
+
+@traced("reviewer")
+async def areviewer_node(state: AgentState):
+    # The grounding check embeds sentences on the CPU, keep it off the event loop
+    prompt, report, update = await asyncio.to_thread(review_request, state)
+    if update:
+        return update
+    try:
+        if report:
+            response = await get_llm().ainvoke(prompt, config=NO_STREAM)
+            return finish_repair(state, report, response.content)
+        response = await get_llm().ainvoke(prompt)
+        return finish_review(state, content=response.content)
+    except Exception as e:
+        return finish_review(state, error=e)
+
+def visualizer_prompt(state: AgentState) -> str:
+    # The previous answer in the memory window, else the rolling summary, else the question itself
+    history = state['messages'][:-1]
+    context = history[-1].content if history else state.get('summary') or current_question(state)
+    report_progress("🎨 Visualizer is drawing a flowchart...")
+    prompt = f"""
+    Based on this context: {context}
+    
+    User Query: {current_question(state)}
+    
+    Task:
+    1. If the user said "I don't understand", first provide a **Key Points** summary (bullet points) to clarify the concept.
+    2. Then, create a MERMAID.JS flowchart to visualize it.
+    
+    Output Format:
+    [Key Points explanation if needed]
+    
+    ```mermaid
+    graph TD
+    ...code...
+    ```
+    """
+    return prompt
+
+def finish_visualization(content: str = None, error: Exception = None):
+    if error is not None:
+        print(f"Visualizer failed: {error}")
+        if is_rate_limit_error(error):
+             return answer_update("(Visualization skipped due to API Rate Limit. Please try again later.)")
+        return answer_update("(Visualization Failed)")
+    # We return the full content now (Text + Code) so the user sees the clarification.
+    return answer_update(content)
+
+@traced("visualizer")
+def visualizer_node(state: AgentState):
+    try:
+        response = get_llm().invoke(visualizer_prompt(state))
+        return finish_visualization(content=response.content)
+    except Exception as e:
+        return finish_visualization(error=e)
+
+@traced("visualizer")
+async def avisualizer_node(state: AgentState):
+    try:
+        response = await get_llm().ainvoke(visualizer_prompt(state))
+        return finish_visualization(content=response.content)
+    except Exception as e:
+        return finish_visualization(error=e)
+
+
+# 4. Build Graph
+def route_logic(state):
+    return state['next_step']
+
+def build_workflow(async_nodes: bool = False):
+    """Compile the agent graph, with the async node variants when `async_nodes` is set."""
+    workflow = StateGraph(AgentState)
+    workflow.add_node("supervisor", supervisor_node)
+    workflow.add_node("researcher", aresearcher_node if async_nodes else researcher_node)
+    workflow.add_node("comparer", acomparer_node if async_nodes else comparer_node)
+    workflow.add_node("lookup", alookup_node if async_nodes else lookup_node)
+    workflow.add_node("chat", achat_node if async_nodes else chat_node)
+    workflow.add_node("reviewer", areviewer_node if async_nodes else reviewer_node)
+    workflow.add_node("visualizer", avisualizer_node if async_nodes else visualizer_node)
+    workflow.set_entry_point("supervisor")
+
+    workflow.add_conditional_edges("supervisor", route_logic, {
+        "RESEARCHER": "researcher",
+        "COMPARE": "comparer",
+        "LOOKUP": "lookup",
+        "CHAT": "chat",
+        "VISUALIZER": "visualizer",
+        "FINISH": END
+    })
+    # Cache hits already carry the reviewed answer, so they go straight back to the supervisor (-> FINISH)
+    for node in ("researcher", "comparer"):
+        workflow.add_conditional_edges(node, route_logic, {
+            "REVIEWER": "reviewer",
+            "CACHED": "supervisor",
+        })
+    workflow.add_edge("reviewer", "supervisor")
+    # Single-pass routes end with their own answer
+    workflow.add_edge("lookup", END)
+    workflow.add_edge("chat", END)
+    workflow.add_edge("visualizer", END)
+    return workflow.compile()
+
+_apps = {}
+_apps_lock = threading.Lock()
+
+def get_app(async_nodes: bool = False):
+    """
+    The compiled agent graph, built on first use and shared by every caller.
+    `async_nodes=True` gives the async variant, for ainvoke / astream callers serving many sessions.
+    """
+    if async_nodes not in _apps:
+        with _apps_lock:
+            if async_nodes not in _apps:
+                _apps[async_nodes] = build_workflow(async_nodes=async_nodes)
+    return _apps[async_nodes]
+
+def __getattr__(name):
+    # `from graph import app` / `async_app` still work, compiling the graph on first access
+    if name == "app":
+        return get_app()
+    if name == "async_app":
+        return get_app(async_nodes=True)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# 5. Streaming
+# Nodes whose LLM output *is* the final answer; the researcher's tokens are only a draft.
+FINAL_ANSWER_NODES = {"reviewer", "visualizer", "lookup", "chat"}
+STREAM_CONFIG = {"configurable": {"stream_progress": True}}
+STREAM_MODES = ["messages", "custom", "values"]
+
+def to_stream_event(mode: str, chunk):
+    """Translate one LangGraph stream item into an (event, payload) tuple, or None to skip it."""
+    if mode == "custom":
+        return ("progress", chunk)
+    if mode == "values":
+        return ("state", chunk)
+    message, metadata = chunk
+    if not isinstance(message, AIMessageChunk) or not message.content:
+        return None # Complete messages are repeated here after their tokens
+    if metadata.get("langgraph_node") in FINAL_ANSWER_NODES:
+        return ("token", message.content)
+    return ("draft_token", message.content)
+
+def _answer_events(state: AgentState):
+    final_state = None
+    streamed_final = False
+    with tracer.span("request") as span: # Parent of every node, retrieval and LLM span of this answer
+        for mode, chunk in get_app().stream(state, config=STREAM_CONFIG, stream_mode=STREAM_MODES):
+            event = to_stream_event(mode, chunk)
+            if event is None:
+                continue
+            if event[0] == "state":
+                final_state = event[1]
+                continue
+            streamed_final = streamed_final or event[0] == "token"
+            yield event
+        if not streamed_final:
+            yield ("token", final_state["final_answer"])
+        yield ("final", {**final_state, "trace_id": span.trace_id})
+
+async def _aanswer_events(state: AgentState):
+    final_state = None
+    streamed_final = False
+    with tracer.span("request") as span:
+        async for mode, chunk in get_app(async_nodes=True).astream(state, config=STREAM_CONFIG, stream_mode=STREAM_MODES):
+            event = to_stream_event(mode, chunk)
+            if event is None:
+                continue
+            if event[0] == "state":
+                final_state = event[1]
+                continue
+            streamed_final = streamed_final or event[0] == "token"
+            yield event
+        if not streamed_final:
+            yield ("token", final_state["final_answer"])
+        yield ("final", {**final_state, "trace_id": span.trace_id})
+
+def stream_answer(state: AgentState):
+    """
+    Run the graph and yield (event, payload) tuples as they happen:
+      ("progress", str)     retrieval done, draft done, reviewer started, ...
+      ("draft_token", str)  researcher tokens, shown until the reviewed answer starts
+      ("token", str)        tokens of the final answer
+      ("final", dict)       the final graph state (as app.invoke would return it), plus the
+                            "trace_id" of its spans (see tracing.tracer.get_trace)
+    If the final answer was not generated token by token (cache hit, review skipped
+    after a 429), its full text is sent as a single "token" event before "final".
+    """
+    # The graph runs in a context of its own, so its "request" span is never the caller's
+    # current span between events (nor left behind if the caller stops iterating).
+    context = contextvars.copy_context()
+    events = _answer_events(state)
+    try:
+        while True:
+            try:
+                event = context.run(next, events)
+            except StopIteration:
+                return
+            yield event
+    finally:
+        context.run(events.close)
+
+async def _await(awaitable):
+    return await awaitable
+
+async def astream_answer(state: AgentState):
+    """Async version of stream_answer, running the async node variants."""
+    # Each step runs as a task in the graph's own context, like stream_answer's context.run
+    context = contextvars.copy_context()
+    events = _aanswer_events(state)
+    try:
+        while True:
+            try:
+                event = await asyncio.create_task(_await(events.__anext__()), context=context)
+            except StopAsyncIteration:
+                return
+            yield event
+    finally:
+        await asyncio.create_task(_await(events.aclose()), context=context)
+
+# 6. Warm-up
+def warm_up(background: bool = False):
+    """
+    Load what the first answer needs ahead of it: the embedding model and ./db,
+    the intent centroids, the Groq client and the compiled graph. Everything is
+    loaded once per process, so calling this again is cheap. With `background`,
+    runs in a daemon thread (returned) so the UI or prompt comes up meanwhile;
+    a question asked before it is done waits only for what is still loading.
+    """
+    if background:
+        thread = threading.Thread(target=_warm_up_quietly, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+    with tracer.span("warm_up"):
+        if os.path.exists(DB_PATH):
+            get_retriever().warm_up()
+        get_router().warm_up()
+        get_llm()
+        get_app()
+
+def _warm_up_quietly():
+    try:
+        warm_up()
+    except Exception as e:
+        # The first question raises the same error where the user sees it
+        print(f"⚠️ Warm-up failed: {e}")
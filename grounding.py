@@ -0,0 +1,151 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List
+import numpy as np
+from lexical_index import tokenize
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import NodeWithScore
+
+GROUNDING_THRESHOLD = float(os.getenv("GROUNDING_THRESHOLD", "0.75")) # Min score for a supported sentence
+GROUNDING_LEXICAL_WEIGHT = float(os.getenv("GROUNDING_LEXICAL_WEIGHT", "0.3")) # Share of word overlap in the score (0 = embeddings only)
+GROUNDING_PARTIAL_MIN = float(os.getenv("GROUNDING_PARTIAL_MIN", "0.5")) # Below this supported share, do a full review
+GROUNDING_WINDOW_SENTENCES = 2 # Context is compared in windows of this many sentences
+GROUNDING_MIN_TOKENS = 4 # Shorter sentences ("Here is a summary:") are not checked
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[*A-Z0-9])")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+_BULLET = re.compile(r"^([-*•]|\d+[.)])\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Sentences of `text`, also splitting on line breaks (bullets, headings). Each is a substring of `text`."""
+    sentences = []
+    for line in text.splitlines():
+        line = _BULLET.sub("", line.strip()) # The marker stays in the text when a sentence is replaced
+        for sentence in _SENTENCE_END.split(line):
+            if sentence.strip():
+                sentences.append(sentence.strip())
+    return sentences
+
+
+@dataclass
+class SentenceGrade:
+    text: str
+    similarity: float # Best cosine similarity to a context window
+    overlap: float # Share of the sentence's words found in the context
+    score: float
+    supported: bool
+    evidence: int = -1 # Index of the best matching chunk
+
+
+@dataclass
+class GroundingReport:
+    sentences: List[SentenceGrade] = field(default_factory=list)
+
+    @property
+    def checked(self) -> List[SentenceGrade]:
+        return [s for s in self.sentences if s.evidence >= 0]
+
+    @property
+    def unsupported(self) -> List[SentenceGrade]:
+        return [s for s in self.sentences if not s.supported]
+
+    @property
+    def grounded(self) -> bool:
+        return not self.unsupported
+
+    @property
+    def supported_share(self) -> float:
+        checked = self.checked
+        return sum(s.supported for s in checked) / len(checked) if checked else 1.0
+
+    @property
+    def min_score(self) -> float:
+        return min((s.score for s in self.checked), default=1.0)
+
+
+def _windows(text: str, size: int) -> List[str]:
+    sentences = split_sentences(text)
+    if len(sentences) <= size:
+        return [text] if text.strip() else []
+    return [" ".join(sentences[i:i + size]) for i in range(0, len(sentences) - size + 1)]
+
+
+def check_grounding(draft: str, nodes: List["NodeWithScore"], embed_model=None,
+                    threshold: float = GROUNDING_THRESHOLD,
+                    lexical_weight: float = GROUNDING_LEXICAL_WEIGHT) -> GroundingReport:
+    """
+    Grade every sentence of `draft` against the retrieved chunks, on the CPU.
+
+    A sentence's score mixes its best cosine similarity to any window of
+    GROUNDING_WINDOW_SENTENCES context sentences (bge embeddings, through the
+    embedding cache so repeated evidence is free) with the share of its words
+    that occur in the context. It is supported if the score clears `threshold`
+    and every number in it also appears in the context.
+    """
+    from llama_index.core.schema import MetadataMode
+    from embeddings import get_embed_model
+    embed_model = embed_model or get_embed_model()
+    report = GroundingReport()
+    sentences = split_sentences(draft)
+    if not sentences:
+        return report
+
+    # Evidence windows, remembering which chunk each one came from
+    windows, owners = [], []
+    context_tokens, context_numbers = set(), set()
+    for i, scored in enumerate(nodes):
+        text = scored.node.get_content(metadata_mode=MetadataMode.LLM) # Includes file names, for attribution
+        context_tokens.update(tokenize(text))
+        context_numbers.update(_NUMBER.findall(text))
+        for window in _windows(scored.node.get_content(metadata_mode=MetadataMode.NONE), GROUNDING_WINDOW_SENTENCES):
+            windows.append(window)
+            owners.append(i)
+
+    to_check = [s for s in sentences if len(tokenize(s)) >= GROUNDING_MIN_TOKENS]
+    similarities: Dict[str, tuple] = {}
+    if to_check and windows:
+        vectors = np.asarray(embed_model.get_text_embedding_batch(to_check + windows), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        matrix = vectors[:len(to_check)] @ vectors[len(to_check):].T
+        for sentence, row in zip(to_check, matrix):
+            best = int(np.argmax(row))
+            similarities[sentence] = (float(row[best]), owners[best])
+
+    for sentence in sentences:
+        if sentence not in similarities and sentence not in to_check:
+            report.sentences.append(SentenceGrade(sentence, 1.0, 1.0, 1.0, True))
+            continue
+        similarity, owner = similarities.get(sentence, (0.0, 0))
+        tokens = set(tokenize(sentence))
+        overlap = len(tokens & context_tokens) / len(tokens) if tokens else 1.0
+        score = (1 - lexical_weight) * similarity + lexical_weight * overlap
+        numbers_ok = set(_NUMBER.findall(sentence)) <= context_numbers
+        report.sentences.append(SentenceGrade(sentence, similarity, overlap, score,
+                                              score >= threshold and numbers_ok, owner))
+    return report
+
+
+def apply_corrections(draft: str, unsupported: List[SentenceGrade], corrections: str) -> str:
+    """
+    Splice the reviewer's numbered corrections ("1. fixed sentence" or "1. DELETE")
+    back into the draft. Sentences the reviewer did not answer for are removed.
+    """
+    fixes = {}
+    for line in corrections.splitlines():
+        match = re.match(r"\s*(\d+)[.):]\s*(.*)", line)
+        if match:
+            fixes[int(match.group(1))] = match.group(2).strip()
+    answer = draft
+    for number, grade in enumerate(unsupported, start=1):
+        fix = fixes.get(number, "DELETE")
+        if fix.upper().strip(" .*") == "DELETE":
+            fix = ""
+        answer = answer.replace(grade.text, fix, 1)
+    # Tidy up what deleted sentences leave behind (empty bullets, double spaces, blank runs)
+    answer = re.sub(r"(?m)^[ \t]*([-*•]|\d+[.)])[ \t]*$\n?", "", answer)
+    answer = re.sub(r"[ \t]{2,}", " ", answer)
+    answer = re.sub(r"\n\s*\n(\s*\n)+", "\n\n", answer)
+    return answer.strip()
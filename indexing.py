@@ -0,0 +1,114 @@
+from typing import Callable, Dict, List, Tuple
+from llama_index.core import Document, Settings
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from tracing import tracer
+
+CHROMA_MAX_BATCH = 5000 # Stay well below Chroma's max_batch_size
+
+
+def chunk_id(doc_id: str, position: int) -> str:
+    """Deterministic node id, so re-running a file upserts over its previous chunks."""
+    return f"{doc_id}#chunk{position}"
+
+
+class StreamingIndexWriter:
+    """
+    Chunks, embeds and upserts documents into a Chroma collection in fixed-size batches.
+
+    Documents are added per source file. Chunks are buffered until `batch_size` of
+    them are waiting, then embedded with one batched encode call and upserted, so
+    peak memory depends on the batch size rather than the corpus. After each batch,
+    `on_commit([(file_path, doc_ids), ...])` is called with the files whose last
+    chunk just got committed (ingest.py uses it to update the manifest).
+
+    Chunk ids are deterministic, and chunks that are already in the collection
+    (committed by an interrupted run) are not embedded again. That makes a
+    crashed ingest resumable from its last committed batch.
+
+    If a `lexical_index` is given, every batch is also written to it, after
+    Chroma. A run interrupted in between leaves chunks that only Chroma has;
+    ingest.py indexes those with LexicalIndex.sync_with_collection on its next run.
+    """
+
+    def __init__(self, chroma_collection, embed_model, batch_size: int = 64, node_parser=None,
+                 on_commit: Callable[[List[Tuple[str, List[str]]]], None] = None, lexical_index=None):
+        self.collection = chroma_collection
+        self.lexical_index = lexical_index
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.node_parser = node_parser or Settings.node_parser
+        self.on_commit = on_commit
+        self._pending: List[Tuple[str, BaseNode]] = []
+        self._remaining: Dict[str, int] = {} # file_path -> chunks not committed yet
+        self._doc_ids: Dict[str, List[str]] = {}
+        self.documents_written = 0
+        self.nodes_written = 0
+        self.nodes_skipped = 0
+
+    def add(self, file_path: str, documents: List[Document]):
+        nodes = []
+        for doc in documents:
+            for position, node in enumerate(self.node_parser.get_nodes_from_documents([doc])):
+                node.id_ = chunk_id(doc.doc_id, position)
+                nodes.append(node)
+        self._doc_ids[file_path] = [doc.doc_id for doc in documents]
+        self.documents_written += len(documents)
+        if not nodes:
+            self._commit([file_path])
+            return
+        self._remaining[file_path] = self._remaining.get(file_path, 0) + len(nodes)
+        self._pending.extend((file_path, node) for node in nodes)
+        while len(self._pending) >= self.batch_size:
+            self._write_batch(self._pending[:self.batch_size])
+            self._pending = self._pending[self.batch_size:]
+
+    def flush(self):
+        if self._pending:
+            self._write_batch(self._pending)
+            self._pending = []
+
+    def _write_batch(self, batch: List[Tuple[str, BaseNode]]):
+        ids = [node.node_id for _, node in batch]
+        existing = set(self.collection.get(ids=ids, include=[])["ids"])
+        todo = [node for _, node in batch if node.node_id not in existing]
+        self.nodes_skipped += len(batch) - len(todo)
+
+        if todo:
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in todo]
+            with tracer.span("ingest.embed", chunks=len(todo)):
+                embeddings = self.embed_model.get_text_embedding_batch(texts)
+            metadatas = [self._metadata(node) for node in todo]
+            documents = [node.get_content(metadata_mode=MetadataMode.NONE) for node in todo]
+            with tracer.span("ingest.upsert", chunks=len(todo)):
+                for start in range(0, len(todo), CHROMA_MAX_BATCH):
+                    end = start + CHROMA_MAX_BATCH
+                    self.collection.upsert(
+                        ids=[node.node_id for node in todo[start:end]],
+                        embeddings=embeddings[start:end],
+                        metadatas=metadatas[start:end],
+                        documents=documents[start:end],
+                    )
+            if self.lexical_index is not None:
+                with tracer.span("ingest.lexical", chunks=len(todo)):
+                    self.lexical_index.add(zip([node.node_id for node in todo], documents, metadatas))
+            self.nodes_written += len(todo)
+
+        completed = []
+        for file_path, _ in batch:
+            self._remaining[file_path] -= 1
+            if self._remaining[file_path] == 0:
+                del self._remaining[file_path]
+                completed.append(file_path)
+        self._commit(completed)
+
+    def _commit(self, file_paths: List[str]):
+        committed = [(file_path, self._doc_ids.pop(file_path)) for file_path in file_paths]
+        if committed and self.on_commit:
+            self.on_commit(committed)
+
+    @staticmethod
+    def _metadata(node: BaseNode) -> dict:
+        # Same layout as ChromaVectorStore.add, so VectorStoreIndex.from_vector_store can read it back
+        metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=True)
+        return {key: ("" if value is None else value) for key, value in metadata.items()}
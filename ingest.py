@@ -1,129 +1,450 @@
-import os
-import sys
-import base64
-from dotenv import load_dotenv
-from typing import List
-from groq import Groq
-
-# Load environment variables
-load_dotenv()
-
-# Check for Groq Key
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-if not GROQ_API_KEY:
-    print("❌ ERROR: GROQ_API_KEY is missing in .env. Needed for Audio/Image processing.")
-    sys.exit(1)
-
-# FORCE DISABLE OPENAI to prevent accidental usage and quota errors
-if "OPENAI_API_KEY" in os.environ:
-    del os.environ["OPENAI_API_KEY"]
-
-# Check for Llama Cloud Key
-if not os.getenv("LLAMA_CLOUD_API_KEY"):
-    print("❌ ERROR: LLAMA_CLOUD_API_KEY is missing in .env. Needed for PDF parsing.")
-    sys.exit(1)
-
-# --- Imports ---
-from llama_parse import LlamaParse
-from llama_index.readers.file import PyMuPDFReader
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, Settings, Document
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-import chromadb
-
-# Initialize Groq Client
-client = Groq(api_key=GROQ_API_KEY)
-
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-
-
-def process_audio(file_path: str) -> Document:
-    print(f"🎤 Transcribing Audio: {os.path.basename(file_path)}...")
-    try:
-        with open(file_path, "rb") as audio_file:
-            # Groq Whisper
-            transcription = client.audio.transcriptions.create(
-                file=(os.path.basename(file_path), audio_file.read()),
-                model="whisper-large-v3",
-                response_format="json", 
-                language="en", 
-                temperature=0.0 
-            )
-            text = transcription.text
-            return Document(text=text, metadata={"file_name": os.path.basename(file_path), "file_type": "audio"})
-    except Exception as e:
-        print(f"❌ Error processing audio {file_path}: {e}")
-        return None
-
-class CustomAudioReader:
-    def load_data(self, file, extra_info=None):
-        doc = process_audio(str(file))
-        return [doc] if doc else []
-
-
-
-def ingest_documents():
-    print("--- STARTING MULTIMODAL INGESTION (GROQ POWERED) ---")
-    
-    # 1. Configure Settings to use LOCAL Embeddings
-    print("⬇️  Loading local embedding model (BAAI/bge-small-en-v1.5)...")
-    embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
-    Settings.embed_model = embed_model
-    Settings.llm = None 
-    
-    # 2. Setup LlamaParse for PDFs (Multimodal Tables/Text)
-    # 2. Setup PyMuPDF for PDFs (Faster, Local)
-    print("📄 Setting up PDF Parser (PyMuPDF)...")
-    # parser = LlamaParse(result_type="markdown", verbose=True, language="en") # Disabled
-    pdf_reader = PyMuPDFReader()
-    # Still keep LlamaParse for Images if needed, or remove if user wants pure PyMuPDF
-    # Since user said "use pymupdf to embed the image", likely means PyMuPDF for PDFs.
-    # For images (.jpg), PyMuPDFReader doesn't support them directly.
-    # LlamaParse is still best for images unless we switch to something else.
-    image_parser = LlamaParse(result_type="markdown", verbose=True, language="en") 
-
-
-    # 2. Setup Custom Readers
-    # 2. Setup Custom Readers
-    audio_reader = CustomAudioReader()
-    # image_reader removed, using LlamaParse
-
-    # 3. Load Data with File Extractors
-    file_extractor = {
-        ".pdf": pdf_reader,
-        ".mp3": audio_reader,
-        ".wav": audio_reader,
-        ".m4a": audio_reader,
-        ".jpg": image_parser,
-        ".jpeg": image_parser,
-        ".png": image_parser,
-        ".ppt": image_parser,
-        ".pptx": image_parser,
-    }
-    
-    print("📂 Scanning ./data for PDFs, Word Docs, Images, and Audio...")
-    reader = SimpleDirectoryReader("./data", file_extractor=file_extractor)
-    documents = reader.load_data()
-    print(f"✅ Loaded {len(documents)} document fragments.")
-
-    # 4. Setup Vector Database (ChromaDB)
-    db = chromadb.PersistentClient(path="./db")
-    chroma_collection = db.get_or_create_collection("project_knowledge")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    # 5. Create Embeddings & Save
-    if documents:
-        print("🧠 Indexing documents into Vector Store...")
-        index = VectorStoreIndex.from_documents(
-            documents, storage_context=storage_context
-        )
-        print("--- INGESTION COMPLETE: Data saved to ./db ---")
-    else:
-        print("⚠️ No documents found to ingest!")
-
-if __name__ == "__main__":
-    ingest_documents()
\ No newline at end of file
+import os
+import sys
+import json
+import time
+import fnmatch
+import tempfile
+import base64
+import hashlib
+import threading
+import contextvars
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from typing import TYPE_CHECKING, List, Dict
+from ratelimit import TokenBucket, retry_with_backoff
+from tracing import tracer, traced
+from lexical_index import LexicalIndex
+from filters import filter_metadata, normalize_tag
+from sharding import SHARD_BY_SOURCE, open_collection, collection_layout, drop_collections
+from audio_segments import AudioSegment, split_audio, transcript_pieces
+
+# Groq, LlamaParse, llama_index, chromadb and the embedding model are imported where
+# first used, so importing this module is cheap and has no side effects.
+if TYPE_CHECKING:
+    from llama_index.core import Document
+
+# Load environment variables
+load_dotenv()
+
+DATA_PATH = "./data"
+DB_PATH = "./db"
+COLLECTION_NAME = "project_knowledge"
+# Manifest of already-ingested files (path -> size, mtime, sha256, doc ids), kept next to ./db
+MANIFEST_PATH = "./db_manifest.json"
+# Optional {"glob pattern": ["tag", ...]} rules for file names in ./data, e.g. {"q3_*": ["finance"]}
+TAGS_PATH = os.getenv("INGEST_TAGS_PATH", "./tags.json")
+
+# --- Pipeline Settings (override in .env) ---
+REMOTE_CONCURRENCY = int(os.getenv("INGEST_REMOTE_CONCURRENCY", "4")) # Parallel Whisper / LlamaParse calls
+PDF_WORKERS = int(os.getenv("INGEST_PDF_WORKERS", str(os.cpu_count() or 1))) # Processes for local parsing
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64")) # Chunks per embed + upsert batch
+AUDIO_CONCURRENCY = int(os.getenv("INGEST_AUDIO_CONCURRENCY", "4")) # Parallel Whisper requests per recording
+whisper_limiter = TokenBucket(float(os.getenv("GROQ_WHISPER_RPM", "20")))
+llama_parse_limiter = TokenBucket(float(os.getenv("LLAMA_PARSE_RPM", "60")))
+
+AUDIO_EXTS = {".mp3", ".wav", ".m4a"}
+LLAMA_PARSE_EXTS = {".jpg", ".jpeg", ".png", ".ppt", ".pptx"}
+
+def check_environment():
+    """Exit early if a key the ingestion needs is missing."""
+    # Check for Groq Key
+    if not os.getenv("GROQ_API_KEY"):
+        print("❌ ERROR: GROQ_API_KEY is missing in .env. Needed for Audio/Image processing.")
+        sys.exit(1)
+
+    # FORCE DISABLE OPENAI to prevent accidental usage and quota errors
+    if "OPENAI_API_KEY" in os.environ:
+        del os.environ["OPENAI_API_KEY"]
+
+    # Check for Llama Cloud Key
+    if not os.getenv("LLAMA_CLOUD_API_KEY"):
+        print("❌ ERROR: LLAMA_CLOUD_API_KEY is missing in .env. Needed for PDF parsing.")
+        sys.exit(1)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_groq_client():
+    """Return the process-wide Groq client (for Whisper), creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from groq import Groq
+                _client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    return _client
+
+
+def create_image_parser():
+    """LlamaParse for images and slides."""
+    from llama_parse import LlamaParse
+    # ignore_errors=False so 429s reach our retry/backoff instead of being swallowed
+    return LlamaParse(result_type="markdown", verbose=True, language="en", ignore_errors=False)
+
+
+def encode_image(image_path):
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+
+
+def transcribe_segment(segment: AudioSegment):
+    def request():
+        # Streamed from disk, and reopened if a 429 makes us send it again
+        with open(segment.path, "rb") as audio_file:
+            return get_groq_client().audio.transcriptions.create(
+                file=(os.path.basename(segment.path), audio_file),
+                model="whisper-large-v3",
+                response_format="verbose_json", # Timestamped segments
+                language="en",
+                temperature=0.0
+            )
+    with tracer.span("ingest.transcribe_segment", start_s=segment.start):
+        # Groq Whisper (shared rate limit, retried with backoff on 429)
+        return retry_with_backoff(request, limiter=whisper_limiter)
+
+def audio_document(text: str, file_name: str, start: float, end: float) -> "Document":
+    from llama_index.core import Document
+    metadata = {"file_name": file_name, "file_type": "audio", "start_s": round(start, 2)}
+    if end is not None:
+        metadata["end_s"] = round(end, 2)
+    doc = Document(text=text, metadata=metadata)
+    # Shown as a time range in the source label (tools.format_source), not embedded
+    doc.excluded_embed_metadata_keys.extend(["start_s", "end_s"])
+    doc.excluded_llm_metadata_keys.extend(["start_s", "end_s"])
+    return doc
+
+def process_audio(file_path: str) -> List["Document"]:
+    """
+    Transcribe a recording as timed passages: split on pauses into pieces of at most
+    AUDIO_SEGMENT_SECONDS, transcribe the pieces in parallel, and return one Document
+    per ~AUDIO_NODE_SECONDS of speech with its start/end time in the recording.
+    """
+    file_name = os.path.basename(file_path)
+    print(f"🎤 Transcribing Audio: {file_name}...")
+    try:
+        with tempfile.TemporaryDirectory(prefix="rag_audio_") as workdir:
+            segments = split_audio(file_path, workdir)
+            with ThreadPoolExecutor(max_workers=min(AUDIO_CONCURRENCY, len(segments))) as pool:
+                # copy_context() keeps the requests under this file's ingest.transcribe span
+                futures = [pool.submit(contextvars.copy_context().run, transcribe_segment, segment)
+                           for segment in segments]
+                transcriptions = [future.result() for future in futures]
+        documents = [audio_document(text, file_name, start, end)
+                     for segment, transcription in zip(segments, transcriptions)
+                     for start, end, text in transcript_pieces(segment, transcription)]
+        if len(segments) > 1:
+            print(f"🎤 {file_name}: {len(segments)} segments, {len(documents)} timed passages.")
+        return documents
+    except Exception as e:
+        print(f"❌ Error processing audio {file_path}: {e}")
+        return []
+
+class CustomAudioReader:
+    def load_data(self, file, extra_info=None):
+        documents = process_audio(str(file))
+        for doc in documents:
+            doc.metadata.update(extra_info or {})
+        return documents
+
+
+# --- Incremental Ingestion Manifest ---
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest() -> Dict[str, dict]:
+    # A manifest without its database is meaningless (e.g. ./db was deleted), so start over.
+    if not os.path.exists(MANIFEST_PATH) or not os.path.exists(DB_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable manifest {MANIFEST_PATH}: {e}")
+        return {}
+
+def save_manifest(files: Dict[str, dict]):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "files": files}, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def plan_ingestion(input_files: List[str], manifest: Dict[str, dict]):
+    """
+    Compare the files on disk with the manifest.
+    Returns (to_ingest, removed, manifest) where `manifest` already has fresh
+    stat info for files whose content hash did not change.
+    """
+    to_ingest = []
+    for file_path in input_files:
+        stat = os.stat(file_path)
+        entry = manifest.get(file_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            continue # Fast path: untouched since last run
+        sha256 = file_sha256(file_path)
+        if entry and entry["sha256"] == sha256:
+            # Touched but identical content (e.g. copied back), no need to re-embed
+            entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            continue
+        to_ingest.append((file_path, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}))
+
+    present = set(input_files)
+    removed = [file_path for file_path in manifest if file_path not in present]
+    return to_ingest, removed, manifest
+
+
+
+# --- Staged Extraction Pipeline ---
+def load_local_file(file_path: str):
+    """Process-pool worker: PDFs via PyMuPDF and everything else via the default readers."""
+    from llama_index.core import SimpleDirectoryReader
+    from llama_index.readers.file import PyMuPDFReader
+    reader = SimpleDirectoryReader(input_files=[file_path], file_extractor={".pdf": PyMuPDFReader()}, filename_as_id=True)
+    return file_path, reader.load_data()
+
+def load_remote_file(file_path: str, file_extractor: dict):
+    """Thread-pool worker: audio (Groq Whisper) and images/slides (LlamaParse)."""
+    from llama_index.core import SimpleDirectoryReader
+    reader = SimpleDirectoryReader(input_files=[file_path], file_extractor=dict(file_extractor),
+                                   filename_as_id=True, raise_on_error=True)
+    llama_parse = os.path.splitext(file_path)[1].lower() in LLAMA_PARSE_EXTS
+    with tracer.span("ingest.llama_parse" if llama_parse else "ingest.transcribe", file=os.path.basename(file_path)):
+        try:
+            if llama_parse:
+                return file_path, retry_with_backoff(reader.load_data, limiter=llama_parse_limiter)
+            return file_path, reader.load_data() # process_audio handles its own rate limit
+        except Exception as e:
+            print(f"❌ Error processing {file_path}: {e}")
+            return file_path, []
+
+def extract_documents(file_paths: List[str], file_extractor: dict):
+    """
+    Run all extractors concurrently and yield (file_path, documents) as each file finishes.
+    Remote (I/O-bound) extractors share a bounded thread pool and local (CPU-bound)
+    parsing runs in a process pool. Only a couple of files per worker are queued
+    at a time so finished results never pile up ahead of the indexing stage.
+    """
+    remote_exts = AUDIO_EXTS | LLAMA_PARSE_EXTS
+    remote_files = deque(p for p in file_paths if os.path.splitext(p)[1].lower() in remote_exts)
+    local_files = deque(p for p in file_paths if os.path.splitext(p)[1].lower() not in remote_exts)
+
+    # spawn, not fork: the thread pool, tracer and SQLite/Chroma handles may be mid-use when
+    # a worker starts, and a forked child would inherit their locks in whatever state they were
+    with ThreadPoolExecutor(max_workers=REMOTE_CONCURRENCY) as thread_pool, \
+         ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn")) as process_pool:
+        lanes = [
+            # copy_context() so the remote calls are traced under the caller's ingest span
+            (remote_files, REMOTE_CONCURRENCY,
+             lambda p: thread_pool.submit(contextvars.copy_context().run, load_remote_file, p, file_extractor), set()),
+            (local_files, PDF_WORKERS, lambda p: process_pool.submit(load_local_file, p), set()),
+        ]
+        while True:
+            for queue, workers, submit, pending in lanes:
+                while queue and len(pending) < 2 * workers:
+                    pending.add(submit(queue.popleft()))
+            in_flight = set().union(*(pending for _, _, _, pending in lanes))
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                for _, _, _, pending in lanes:
+                    pending.discard(future)
+                yield future.result()
+
+def tag_content_hash(documents: List["Document"], sha256: str):
+    # Lets a resumed run tell its own leftovers apart from those of an older file version
+    for doc in documents:
+        doc.metadata["content_sha256"] = sha256
+        doc.excluded_embed_metadata_keys.append("content_sha256")
+        doc.excluded_llm_metadata_keys.append("content_sha256")
+
+
+# --- Filter Metadata (source type, ingestion time, tags; see filters.py) ---
+def load_tag_rules() -> Dict[str, List[str]]:
+    if not os.path.exists(TAGS_PATH):
+        return {}
+    try:
+        with open(TAGS_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable tag rules {TAGS_PATH}: {e}")
+        return {}
+
+def file_tags(file_path: str, tag_rules: Dict[str, List[str]]) -> List[str]:
+    relative = os.path.relpath(file_path, DATA_PATH).replace(os.sep, "/")
+    tags = []
+    for pattern, rule_tags in tag_rules.items():
+        if fnmatch.fnmatch(relative, pattern) or fnmatch.fnmatch(os.path.basename(relative), pattern):
+            tags.extend(rule_tags)
+    return sorted({normalize_tag(t) for t in tags} - {""})
+
+def tag_filter_metadata(documents: List["Document"], file_path: str, info: dict):
+    # Only for filtering: kept out of the embedded and prompted text, so tagging never re-embeds
+    metadata = filter_metadata(file_path, info["ingested_at"], info["tags"])
+    for doc in documents:
+        doc.metadata.update(metadata)
+        doc.excluded_embed_metadata_keys.extend(metadata)
+        doc.excluded_llm_metadata_keys.extend(metadata)
+
+def sync_filter_metadata(chroma_collection, lexical_index: LexicalIndex, manifest: Dict[str, dict],
+                         tag_rules: Dict[str, List[str]]) -> int:
+    """
+    Bring the filter metadata of already-ingested files up to date in place (in Chroma and
+    the lexical index): files ingested before filters existed, and files whose tags changed.
+    Returns the number of files updated.
+    """
+    updated = 0
+    for file_path, entry in manifest.items():
+        tags = file_tags(file_path, tag_rules)
+        if "ingested_at" in entry and entry.get("tags") == tags:
+            continue
+        ingested_at = entry.get("ingested_at", int(time.time()))
+        removed_tags = set(entry.get("tags", [])) - set(tags)
+        ids = chroma_collection.get(where={"file_path": file_path}, include=[])["ids"]
+        if ids:
+            metadata = filter_metadata(file_path, ingested_at, tags, removed_tags)
+            chroma_collection.update(ids=ids, metadatas=[metadata] * len(ids))
+            lexical_index.update_file_metadata(file_path, metadata)
+        entry.update(ingested_at=ingested_at, tags=tags)
+        updated += 1
+    return updated
+
+@traced("ingest")
+def ingest_documents():
+    print("--- STARTING MULTIMODAL INGESTION (GROQ POWERED) ---")
+    check_environment()
+    import chromadb
+    from llama_index.core import SimpleDirectoryReader, Settings
+    from llama_index.readers.file import PyMuPDFReader
+    from embeddings import get_embed_model
+    from indexing import StreamingIndexWriter
+    
+    # 1. Configure Settings to use LOCAL Embeddings
+    # (wrapped in the on-disk embedding cache, so unchanged chunks are never re-encoded)
+    embed_model = get_embed_model()
+    Settings.embed_model = embed_model
+    Settings.llm = None 
+    
+    # 2. Setup LlamaParse for PDFs (Multimodal Tables/Text)
+    # 2. Setup PyMuPDF for PDFs (Faster, Local)
+    print("📄 Setting up PDF Parser (PyMuPDF)...")
+    # parser = LlamaParse(result_type="markdown", verbose=True, language="en") # Disabled
+    pdf_reader = PyMuPDFReader()
+    # Still keep LlamaParse for Images if needed, or remove if user wants pure PyMuPDF
+    # Since user said "use pymupdf to embed the image", likely means PyMuPDF for PDFs.
+    # For images (.jpg), PyMuPDFReader doesn't support them directly.
+    # LlamaParse is still best for images unless we switch to something else.
+    image_parser = create_image_parser()
+
+
+    # 2. Setup Custom Readers
+    # 2. Setup Custom Readers
+    audio_reader = CustomAudioReader()
+    # image_reader removed, using LlamaParse
+
+    # 3. Load Data with File Extractors
+    file_extractor = {
+        ".pdf": pdf_reader,
+        ".mp3": audio_reader,
+        ".wav": audio_reader,
+        ".m4a": audio_reader,
+        ".jpg": image_parser,
+        ".jpeg": image_parser,
+        ".png": image_parser,
+        ".ppt": image_parser,
+        ".pptx": image_parser,
+    }
+    
+    print("📂 Scanning ./data for PDFs, Word Docs, Images, and Audio...")
+    with tracer.span("ingest.plan") as span:
+        try:
+            input_files = [str(f) for f in SimpleDirectoryReader(DATA_PATH).input_files]
+        except ValueError:
+            input_files = [] # SimpleDirectoryReader raises when the folder is empty
+
+        manifest = load_manifest()
+        to_ingest, removed, manifest = plan_ingestion(input_files, manifest)
+        span.set(files=len(input_files), to_ingest=len(to_ingest), removed=len(removed))
+    unchanged = len(input_files) - len(to_ingest)
+    print(f"🗂️  {len(to_ingest)} new/changed, {len(removed)} removed, {unchanged} unchanged file(s).")
+
+    # 4. Setup Vector Database (ChromaDB), one collection per source type if SHARD_BY_SOURCE=1
+    db = chromadb.PersistentClient(path=DB_PATH)
+    layout = "sharded" if SHARD_BY_SOURCE else "single"
+    lexical_index = LexicalIndex(DB_PATH)
+    if collection_layout(db, COLLECTION_NAME) not in (None, layout):
+        print(f"🔀 Switching the vector store to the {layout} layout, re-indexing every file...")
+        drop_collections(db, COLLECTION_NAME)
+        lexical_index.clear()
+        to_ingest, removed, manifest = plan_ingestion(input_files, {})
+    chroma_collection = open_collection(db, COLLECTION_NAME, sharded=SHARD_BY_SOURCE, create=True)
+    # BM25 index next to the collection: index only the chunks it is missing (older databases,
+    # interrupted runs) and drop the ones the vector store no longer has
+    added, removed_chunks = lexical_index.sync_with_collection(chroma_collection)
+    if added or removed_chunks:
+        print(f"🔤 Synced lexical (BM25) index with the vector store: +{added} / -{removed_chunks} chunks.")
+
+    # 5. Drop vectors of removed and modified files (by document id)
+    with tracer.span("ingest.delete_stale"):
+        for file_path in removed + [file_path for file_path, _ in to_ingest]:
+            entry = manifest.pop(file_path, None)
+            if entry:
+                for doc_id in entry["doc_ids"]:
+                    chroma_collection.delete(where={"document_id": doc_id})
+                    lexical_index.delete_document(doc_id)
+                print(f"🗑️  Removed stale vectors for {os.path.basename(file_path)}")
+        for file_path, info in to_ingest:
+            # Chunks committed by an interrupted run are kept (and skipped) if the file is unchanged since
+            chroma_collection.delete(where={"$and": [{"file_path": file_path}, {"content_sha256": {"$ne": info["sha256"]}}]})
+            lexical_index.delete_file(file_path, keep_sha256=info["sha256"])
+
+    # 6. Filter metadata: stamp new/changed files, re-tag unchanged ones whose tags changed
+    tag_rules = load_tag_rules()
+    retagged = sync_filter_metadata(chroma_collection, lexical_index, manifest, tag_rules)
+    if retagged:
+        print(f"🏷️  Updated filter metadata of {retagged} unchanged file(s).")
+    ingested_at = int(time.time())
+    for file_path, info in to_ingest:
+        info.update(ingested_at=ingested_at, tags=file_tags(file_path, tag_rules))
+    save_manifest(manifest)
+
+    # 7. Extract new/changed files in parallel and stream them into batched embedding + upserts
+    file_info = dict(to_ingest)
+
+    def commit_files(committed):
+        for file_path, doc_ids in committed:
+            manifest[file_path] = dict(file_info[file_path], doc_ids=doc_ids)
+        save_manifest(manifest)
+        print(f"🧠 Indexed {writer.documents_written} document fragments ({writer.nodes_written} chunks) so far...")
+
+    writer = StreamingIndexWriter(chroma_collection, embed_model, batch_size=INGEST_BATCH_SIZE,
+                                  on_commit=commit_files, lexical_index=lexical_index)
+    for file_path, file_documents in extract_documents(list(file_info), file_extractor):
+        if not file_documents:
+            continue # Extraction failed, leave it out of the manifest so the next run retries it
+        tag_content_hash(file_documents, file_info[file_path]["sha256"])
+        tag_filter_metadata(file_documents, file_path, file_info[file_path])
+        with tracer.span("ingest.index_file", file=os.path.basename(file_path), documents=len(file_documents)):
+            writer.add(file_path, file_documents) # Also embeds + upserts every batch this file completes
+    writer.flush()
+
+    if writer.documents_written:
+        resumed = f", {writer.nodes_skipped} already committed by a previous run" if writer.nodes_skipped else ""
+        print(f"✅ Indexed {writer.documents_written} document fragments ({writer.nodes_written} chunks{resumed}).")
+    elif not to_ingest:
+        print("⚡ Nothing new to ingest, vector store is up to date.")
+    if input_files:
+        print("--- INGESTION COMPLETE: Data saved to ./db ---")
+    else:
+        print("⚠️ No documents found to ingest!")
+
+if __name__ == "__main__":
+    ingest_documents()
@@ -0,0 +1,226 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+from filters import TAG_PREFIX, RetrievalFilter
+
+LEXICAL_INDEX_FILE = "bm25.sqlite3" # Lives inside the Chroma directory (./db)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from", "how", "in",
+    "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where",
+    "which", "who", "why", "with", "about", "me", "tell",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound tokens such as file names ("q3_report.pdf")
+    or formulas ("e=mc2") are kept whole *and* split into their parts.
+    """
+    tokens = []
+    for compound in re.findall(r"[a-z0-9]+(?:[._=+/'-][a-z0-9]+)*", text.lower()):
+        parts = re.findall(r"[a-z0-9]+", compound)
+        if len(parts) > 1:
+            tokens.append(compound)
+        tokens.extend(p for p in parts if p not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    Incrementally updated BM25 inverted index in SQLite, kept next to the Chroma
+    collection and keyed by the same chunk ids.
+
+    Chunks carry their document id, file path and content hash so ingest.py can
+    delete them exactly like it deletes vectors, and the filter metadata (file name,
+    source type, ingestion time, tags) so filtered searches run in SQL.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(db_path, exist_ok=True)
+        self.path = os.path.join(db_path, LEXICAL_INDEX_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                node_id TEXT PRIMARY KEY, ref_doc_id TEXT, file_path TEXT, content_sha256 TEXT, length INTEGER,
+                file_name TEXT, source_type TEXT, ingested_at INTEGER);
+            CREATE TABLE IF NOT EXISTS chunk_tags (
+                tag TEXT, node_id TEXT, PRIMARY KEY (tag, node_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS chunk_tags_node ON chunk_tags (node_id);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT, node_id TEXT, tf INTEGER, PRIMARY KEY (term, node_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_node ON postings (node_id);
+            CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (ref_doc_id);
+            CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file_path);
+        """)
+        # Indexes built before filtering lack the filter columns; sync_with_collection fills them in
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        with self._conn:
+            for column, kind in (("file_name", "TEXT"), ("source_type", "TEXT"), ("ingested_at", "INTEGER")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} {kind}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _delete_nodes_locked(self, node_ids: List[str]):
+        self._conn.executemany("DELETE FROM postings WHERE node_id = ?", [(i,) for i in node_ids])
+        self._conn.executemany("DELETE FROM chunk_tags WHERE node_id = ?", [(i,) for i in node_ids])
+        self._conn.executemany("DELETE FROM chunks WHERE node_id = ?", [(i,) for i in node_ids])
+
+    def add(self, chunks: Iterable[Tuple[str, str, dict]]):
+        """Upsert (node_id, text, metadata) chunks in one transaction. The file name is indexed too."""
+        chunks = list(chunks)
+        with self._lock, self._conn:
+            self._delete_nodes_locked([node_id for node_id, _, _ in chunks])
+            for node_id, text, metadata in chunks:
+                counts = Counter(tokenize(f"{metadata.get('file_name', '')} {text}"))
+                self._conn.execute(
+                    "INSERT INTO chunks (node_id, ref_doc_id, file_path, content_sha256, length, file_name) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (node_id, metadata.get("document_id") or metadata.get("ref_doc_id"), metadata.get("file_path"),
+                     metadata.get("content_sha256"), sum(counts.values()), metadata.get("file_name")))
+                self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?)",
+                                       [(term, node_id, tf) for term, tf in counts.items()])
+                self._set_filter_metadata_locked([node_id], metadata)
+
+    def _set_filter_metadata_locked(self, node_ids: List[str], metadata: dict):
+        if "source_type" in metadata:
+            self._conn.executemany("UPDATE chunks SET source_type = ?, ingested_at = ? WHERE node_id = ?",
+                                   [(metadata["source_type"], metadata.get("ingested_at"), i) for i in node_ids])
+        for key, value in metadata.items():
+            if key.startswith(TAG_PREFIX):
+                tag = key[len(TAG_PREFIX):]
+                sql = "INSERT OR IGNORE INTO chunk_tags VALUES (?, ?)" if value is True else \
+                      "DELETE FROM chunk_tags WHERE tag = ? AND node_id = ?"
+                self._conn.executemany(sql, [(tag, i) for i in node_ids])
+
+    def update_file_metadata(self, file_path: str, metadata: dict):
+        """Apply filters.filter_metadata() to a file's chunks, as ingest.py does in Chroma when re-tagging."""
+        with self._lock, self._conn:
+            node_ids = [row[0] for row in self._conn.execute("SELECT node_id FROM chunks WHERE file_path = ?", (file_path,))]
+            self._set_filter_metadata_locked(node_ids, metadata)
+
+    def _delete_where_locked(self, where: str, params: tuple):
+        node_ids = [row[0] for row in self._conn.execute(f"SELECT node_id FROM chunks WHERE {where}", params)]
+        self._delete_nodes_locked(node_ids)
+
+    def delete_document(self, ref_doc_id: str):
+        with self._lock, self._conn:
+            self._delete_where_locked("ref_doc_id = ?", (ref_doc_id,))
+
+    def delete_file(self, file_path: str, keep_sha256: str = None):
+        """Delete a file's chunks, optionally keeping those of content version `keep_sha256`."""
+        with self._lock, self._conn:
+            if keep_sha256:
+                self._delete_where_locked("file_path = ? AND IFNULL(content_sha256, '') != ?", (file_path, keep_sha256))
+            else:
+                self._delete_where_locked("file_path = ?", (file_path,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM chunk_tags")
+            self._conn.execute("DELETE FROM chunks")
+
+    def sync_with_collection(self, chroma_collection, page_size: int = 1000) -> Tuple[int, int]:
+        """
+        Make the index hold exactly the chunks of a Chroma collection: index the ones it
+        is missing (databases built before the lexical index, or a run interrupted between
+        the two writes) and drop the ones Chroma no longer has. Chunks indexed before the
+        filter columns existed get their filter metadata from Chroma. Returns (added, removed).
+        """
+        collection_ids, offset = set(), 0
+        while True:
+            page = chroma_collection.get(include=[], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            collection_ids.update(page["ids"])
+            offset += len(page["ids"])
+        with self._lock:
+            indexed = {row[0] for row in self._conn.execute("SELECT node_id FROM chunks")}
+            untagged = [row[0] for row in self._conn.execute("SELECT node_id FROM chunks WHERE source_type IS NULL")]
+        missing = sorted(collection_ids - indexed)
+        extra = sorted(indexed - collection_ids)
+        if extra:
+            with self._lock, self._conn:
+                self._delete_nodes_locked(extra)
+        for start in range(0, len(missing), page_size):
+            page = chroma_collection.get(ids=missing[start:start + page_size], include=["documents", "metadatas"])
+            self.add(zip(page["ids"], page["documents"], page["metadatas"]))
+        untagged = sorted(set(untagged) & collection_ids)
+        for start in range(0, len(untagged), page_size):
+            page = chroma_collection.get(ids=untagged[start:start + page_size], include=["metadatas"])
+            with self._lock, self._conn:
+                for node_id, metadata in zip(page["ids"], page["metadatas"]):
+                    self._conn.execute("UPDATE chunks SET file_name = ? WHERE node_id = ?", (metadata.get("file_name"), node_id))
+                    self._set_filter_metadata_locked([node_id], metadata)
+        return len(missing), len(extra)
+
+    def file_paths(self) -> List[str]:
+        """Paths of all indexed files."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT file_path FROM chunks WHERE file_path IS NOT NULL")]
+
+    @staticmethod
+    def _filter_sql(filters: Optional[RetrievalFilter]) -> Tuple[str, list]:
+        """The RetrievalFilter as SQL conditions on chunks `c`, matching RetrievalFilter.to_where()."""
+        clauses, params = [], []
+        if not filters:
+            return "", params
+        for column, values in (("file_name", filters.file_names), ("source_type", filters.source_types)):
+            if values:
+                clauses.append(f"c.{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        if filters.ingested_after is not None:
+            clauses.append("c.ingested_at >= ?")
+            params.append(int(filters.ingested_after))
+        if filters.ingested_before is not None:
+            clauses.append("c.ingested_at < ?")
+            params.append(int(filters.ingested_before))
+        for tag in filters.tags:
+            clauses.append("EXISTS (SELECT 1 FROM chunk_tags t WHERE t.tag = ? AND t.node_id = c.node_id)")
+            params.append(tag)
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    def search(self, query: str, top_k: int, filters: Optional[RetrievalFilter] = None) -> List[Tuple[str, float]]:
+        """BM25 top-k as [(node_id, score)], best first, over the chunks matching `filters`."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            total, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM chunks").fetchone()
+            if not total:
+                return []
+            df = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms))
+            # Terms in most chunks barely move BM25 but would pull huge posting lists
+            terms = [t for t in terms if t in df and (df[t] <= total / 2 or len(df) == 1)]
+            if not terms:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            filter_sql, filter_params = self._filter_sql(filters)
+            rows = self._conn.execute(
+                f"SELECT p.term, p.node_id, p.tf, c.length FROM postings p JOIN chunks c ON c.node_id = p.node_id "
+                f"WHERE p.term IN ({placeholders}){filter_sql}", terms + filter_params).fetchall()
+
+        scores = Counter()
+        for term, node_id, tf, length in rows:
+            idf = math.log(1 + (total - df[term] + 0.5) / (df[term] + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / (avg_length or 1))
+            scores[node_id] += idf * tf * (BM25_K1 + 1) / norm
+        return scores.most_common(top_k)
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+from typing import TYPE_CHECKING
+from ratelimit import (TokenBucket, retry_with_backoff, aretry_with_backoff, is_rate_limit_error,
+                       retry_after_seconds, estimate_tokens)
+from tracing import tracer
+
+if TYPE_CHECKING:
+    from langchain_groq import ChatGroq
+
+GROQ_MODEL = "llama-3.1-8b-instant"
+# Groq free-tier quotas for llama-3.1-8b-instant; raise them in .env on a paid plan
+GROQ_RPM = float(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = float(os.getenv("GROQ_TPM", "6000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_COMPLETION_TOKENS = int(os.getenv("LLM_COMPLETION_TOKENS", "512")) # Expected answer size, for TPM budgeting
+
+
+class ScheduledLLM:
+    """
+    One shared ChatGroq (so one pooled HTTP client) behind a request scheduler.
+
+    Every call first takes a request from the RPM bucket and its estimated tokens
+    from the TPM bucket; the estimate is corrected from the response's usage
+    metadata afterwards. 429s pause every caller for the server's Retry-After and
+    are retried with jittered exponential backoff. Safe to share between threads
+    and event loops, so all Streamlit sessions draw from the same quota.
+    """
+
+    def __init__(self, llm: "ChatGroq", rpm: float = GROQ_RPM, tpm: float = GROQ_TPM,
+                 max_retries: int = LLM_MAX_RETRIES):
+        self.llm = llm
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+
+    def _on_error(self, e: Exception):
+        if is_rate_limit_error(e):
+            pause = retry_after_seconds(e)
+            if pause:
+                self.requests.penalize(pause)
+                self.tokens.penalize(pause)
+
+    def _settle(self, response, estimated: int, span):
+        usage = getattr(response, "usage_metadata", None) or {}
+        if usage.get("total_tokens"):
+            self.tokens.adjust(usage["total_tokens"] - estimated)
+        span.set(prompt_tokens=usage.get("input_tokens", estimated - LLM_COMPLETION_TOKENS),
+                 completion_tokens=usage.get("output_tokens", estimate_tokens(str(response.content))))
+
+    def invoke(self, prompt, **kwargs):
+        estimated = estimate_tokens(str(prompt)) + LLM_COMPLETION_TOKENS
+
+        with tracer.span("llm", model=GROQ_MODEL, attempts=0, queue_s=0.0) as span:
+            def call():
+                span.add("attempts", 1)
+                waited = time.perf_counter()
+                self.requests.acquire()
+                self.tokens.acquire(estimated)
+                span.add("queue_s", time.perf_counter() - waited) # Time spent waiting on the RPM/TPM quota
+                try:
+                    return self.llm.invoke(prompt, **kwargs)
+                except Exception as e:
+                    self._on_error(e)
+                    raise
+
+            try:
+                response = retry_with_backoff(call, retries=self.max_retries)
+            finally:
+                span.set(retries=span.attributes["attempts"] - 1)
+            self._settle(response, estimated, span)
+        return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        estimated = estimate_tokens(str(prompt)) + LLM_COMPLETION_TOKENS
+
+        with tracer.span("llm", model=GROQ_MODEL, attempts=0, queue_s=0.0) as span:
+            async def call():
+                span.add("attempts", 1)
+                waited = time.perf_counter()
+                await self.requests.acquire_async()
+                await self.tokens.acquire_async(estimated)
+                span.add("queue_s", time.perf_counter() - waited)
+                try:
+                    return await self.llm.ainvoke(prompt, **kwargs)
+                except Exception as e:
+                    self._on_error(e)
+                    raise
+
+            try:
+                response = await aretry_with_backoff(call, retries=self.max_retries)
+            finally:
+                span.set(retries=span.attributes["attempts"] - 1)
+            self._settle(response, estimated, span)
+        return response
+
+
+_llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm(api_key: str = None) -> ScheduledLLM:
+    """Return the process-wide scheduled Groq client, creating it on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                api_key = api_key or os.getenv("GROQ_API_KEY")
+                if not api_key:
+                    raise ValueError("❌ CRITICAL ERROR: GROQ_API_KEY is missing from .env file!")
+                from langchain_groq import ChatGroq # Imported on first use, it takes a second
+                _llm = ScheduledLLM(ChatGroq(
+                    model=GROQ_MODEL,
+                    temperature=0,
+                    api_key=api_key,
+                    max_retries=0, # Retries are handled by the scheduler, with shared backoff
+                ))
+    return _llm
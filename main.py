@@ -1,43 +1,59 @@
-from graph import app
-from langchain_core.messages import HumanMessage
-
-def main():
-    print("==========================================")
-    print("🤖 MULTIMODAL RAG AGENT (GROQ EDITION)")
-    print("Drop PDFs, Images, Audio in /data")
-    print("Run `persist_ingest.py` or `ingest.py` first!")
-    print("==========================================")
-
-    chat_history = []
-    
-    while True:
-        user_input = input("\n👤 You: ")
-        if user_input.lower() in ["exit", "quit"]:
-            break
-
-        # Append User Message to History
-        chat_history.append(HumanMessage(content=user_input))
-        
-        # Run the Agent Graph with History
-        initial_state = {"messages": chat_history, "next_step": ""}
-        
-        result = app.invoke(initial_state)
-        
-        # Get Final Response (Last AI Message)
-        # The graph returns the updated state. We want to grab the NEW messages.
-        # But efficiently, we can just grab the last message content.
-        final_msg_obj = result["messages"][-1]
-        final_msg = final_msg_obj.content
-        
-        # Update History with valid messages only (avoid duplicates if graph returns all)
-        # LangGraph usually returns the final state.
-        chat_history = result["messages"]
-        
-        print(f"\n🤖 AI: {final_msg}")
-        
-        # Check if it returned Mermaid Code (Visualization)
-        if "graph TD" in final_msg or "graph LR" in final_msg:
-            print("\n[INFO] Flowchart detected! Copy the code above into https://mermaid.live to view it.")
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+from graph import stream_answer, warm_up, WARM_UP
+from memory import ConversationMemory
+from tracing import start_metrics_server
+
+def main():
+    print("==========================================")
+    print("🤖 MULTIMODAL RAG AGENT (GROQ EDITION)")
+    print("Drop PDFs, Images, Audio in /data")
+    print("Run `persist_ingest.py` or `ingest.py` first!")
+    print("==========================================")
+
+    # Load the embedding model, ./db, the intent centroids and the graph once, while the first question is typed
+    if WARM_UP != "off":
+        warm_up(background=WARM_UP == "background")
+    start_metrics_server() # Only if METRICS_PORT is set
+
+    # Last few turns verbatim + a rolling summary, so each turn's state stays the same size
+    memory = ConversationMemory()
+    
+    while True:
+        user_input = input("\n👤 You: ")
+        if user_input.lower() in ["exit", "quit"]:
+            break
+
+        # Run the Agent Graph with the conversation memory
+        initial_state = {**memory.to_state(user_input), "next_step": ""}
+        
+        # Stream progress lines and tokens as the graph produces them
+        result = None
+        printing = None # Which token stream is currently being printed
+        for event, payload in stream_answer(initial_state):
+            if event == "progress":
+                print(("\n" if printing else "") + payload)
+                printing = None
+            elif event == "draft_token":
+                if printing != "draft":
+                    print("\n📝 Draft: ", end="", flush=True)
+                    printing = "draft"
+                print(payload, end="", flush=True)
+            elif event == "token":
+                if printing != "final":
+                    print("\n\n🤖 AI: ", end="", flush=True)
+                    printing = "final"
+                print(payload, end="", flush=True)
+            elif event == "final":
+                result = payload
+        print()
+
+        final_msg = result["final_answer"]
+        
+        # Update History (older turns get folded into the summary)
+        memory.add_turn(user_input, final_msg)
+        
+        # Check if it returned Mermaid Code (Visualization)
+        if "graph TD" in final_msg or "graph LR" in final_msg:
+            print("\n[INFO] Flowchart detected! Copy the code above into https://mermaid.live to view it.")
+
+if __name__ == "__main__":
+    main()
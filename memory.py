@@ -0,0 +1,103 @@
+import os
+import threading
+from typing import List
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from ratelimit import estimate_tokens
+
+MEMORY_WINDOW_TURNS = int(os.getenv("MEMORY_WINDOW_TURNS", "3")) # Most recent Q&A pairs kept verbatim
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300")) # Budget of the rolling summary
+MEMORY_ANSWER_CHARS = 300 # Per-answer excerpt used by the extractive fallback
+
+
+def render_transcript(messages: List[BaseMessage]) -> str:
+    """'User: ...' / 'Assistant: ...' lines, for prompts."""
+    lines = []
+    for message in messages:
+        role = "User" if isinstance(message, HumanMessage) else "Assistant"
+        lines.append(f"{role}: {message.content}")
+    return "\n".join(lines)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the end of `text` (the most recent facts) within roughly `max_tokens`."""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return "..." + text[-max_chars:].split(" ", 1)[-1]
+
+
+class ConversationMemory:
+    """
+    Bounded conversation memory for one chat session.
+
+    The last `window_turns` question/answer pairs are kept verbatim. Once twice that
+    many have piled up, the oldest `window_turns` are folded into a rolling summary
+    with one LLM call, so summarization runs once every `window_turns` turns. If
+    that call fails (e.g. 429), the turns are folded in extractively instead. The
+    summary is capped at `summary_tokens`, so the state handed to the graph, and
+    the prompts built from it, stop growing after the first few turns.
+    """
+
+    def __init__(self, window_turns: int = MEMORY_WINDOW_TURNS, summary_tokens: int = MEMORY_SUMMARY_TOKENS,
+                 llm=None):
+        self.window_turns = window_turns
+        self.summary_tokens = summary_tokens
+        self.llm = llm
+        self.summary = ""
+        self.messages: List[BaseMessage] = []
+        self._lock = threading.Lock()
+
+    def to_state(self, question: str) -> dict:
+        """Initial graph state for a new question."""
+        with self._lock:
+            return {
+                "messages": list(self.messages) + [HumanMessage(content=question)],
+                "question": question,
+                "summary": self.summary,
+            }
+
+    def add_turn(self, question: str, answer: str):
+        with self._lock:
+            self.messages += [HumanMessage(content=question), AIMessage(content=answer)]
+            if len(self.messages) < 4 * self.window_turns:
+                return
+            cut = 2 * self.window_turns
+            folded, self.messages = self.messages[:cut], self.messages[cut:]
+            self.summary = self._summarize(self.summary, folded)
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.messages = []
+
+    def _summarize(self, summary: str, folded: List[BaseMessage]) -> str:
+        llm = self.llm
+        if llm is None:
+            from llm import get_llm
+            llm = get_llm()
+        prompt = (
+            f"Update the running summary of a conversation between a user and a document assistant.\n\n"
+            f"Current summary:\n{summary or '(empty)'}\n\n"
+            f"New turns:\n{render_transcript(folded)}\n\n"
+            f"Write the updated summary in at most {self.summary_tokens * 3 // 4} words. Keep the topics, "
+            f"documents and facts the user may refer back to; drop pleasantries.\n\nUpdated summary:"
+        )
+        try:
+            return trim_to_tokens(llm.invoke(prompt).content.strip(), self.summary_tokens)
+        except Exception as e:
+            print(f"⚠️ Memory summarization failed, keeping an excerpt instead: {e}")
+            return self._extractive_summary(summary, folded)
+
+    def _extractive_summary(self, summary: str, folded: List[BaseMessage]) -> str:
+        lines = [summary] if summary else []
+        for message in folded:
+            if isinstance(message, HumanMessage):
+                lines.append(f"User asked: {message.content}")
+            else:
+                excerpt = message.content[:MEMORY_ANSWER_CHARS]
+                lines.append(f"Answer: {excerpt}{'...' if len(message.content) > MEMORY_ANSWER_CHARS else ''}")
+        return trim_to_tokens("\n".join(lines), self.summary_tokens)
+
+    def token_count(self) -> int:
+        """Approximate tokens the memory adds to each turn's state."""
+        return estimate_tokens(self.summary) + sum(estimate_tokens(m.content) for m in self.messages)
@@ -0,0 +1,310 @@
+"""
+Quantized ONNX backend for the bge embedder (EMBED_BACKEND=onnx).
+
+The fp32 ONNX graph is taken from the model's Hugging Face repo (or exported
+with optimum when the repo has none), quantized to int8 with onnxruntime's
+dynamic quantization and cached in EMBED_ONNX_PATH. Inference runs on
+onnxruntime with a fixed intra-op thread count, no PyTorch involved.
+
+    python onnx_embedding.py --parity   # ranking agreement with the fp32 PyTorch model
+    python onnx_embedding.py --bench    # speed and memory of both backends
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import resource
+import threading
+import subprocess
+from concurrent.futures import Future
+from typing import List
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+EMBED_ONNX_PATH = os.getenv("EMBED_ONNX_PATH", "./onnx_models")
+# onnxruntime scales with physical cores; hyper-threads mostly add contention
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", str(max(1, (os.cpu_count() or 2) // 2))))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "2")) # How long a query waits for others to batch with
+EMBED_MAX_LENGTH = 512
+# Same query prefix HuggingFaceEmbedding adds for English bge models, so both backends embed alike
+BGE_QUERY_INSTRUCTION = "Represent this question for searching relevant passages: "
+
+PARITY_TOP_K = 10
+PARITY_MIN_OVERLAP = 0.9 # Mean share of the fp32 top-k the int8 model must also return
+PARITY_MIN_COSINE = 0.98 # Mean cosine between fp32 and int8 vectors of the same text
+
+
+def export_quantized_model(model_name: str, model_dir: str) -> str:
+    """Create `model_dir`/model_int8.onnx (+ tokenizer.json) once. Returns the int8 model path."""
+    int8_path = os.path.join(model_dir, "model_int8.onnx")
+    if os.path.exists(int8_path):
+        return int8_path
+    try:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+    except ImportError as e:
+        raise ImportError("The ONNX backend needs `pip install onnxruntime onnx`.") from e
+    os.makedirs(model_dir, exist_ok=True)
+    print(f"📦 Preparing int8 ONNX model for {model_name} (one-time)...")
+
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    try:
+        from huggingface_hub import hf_hub_download
+        shutil.copy(hf_hub_download(model_name, "onnx/model.onnx"), fp32_path)
+        shutil.copy(hf_hub_download(model_name, "tokenizer.json"), os.path.join(model_dir, "tokenizer.json"))
+    except Exception as e:
+        print(f"⚠️ No ONNX graph in the model repo ({e}), exporting with optimum...")
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+            from transformers import AutoTokenizer
+        except ImportError as import_error:
+            raise ImportError("Exporting to ONNX needs `pip install optimum[onnxruntime]`.") from import_error
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(model_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(model_dir)
+
+    tmp_path = int8_path + ".tmp"
+    quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-text encodes (e.g. queries from several sessions)
+    into one batch. A request waits at most `wait_ms` for company.
+    """
+
+    def __init__(self, encode, max_batch: int, wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self._encode = encode
+        self.max_batch = max_batch
+        self.wait = wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> List[float]:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.wait
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self._encode([text for text, _ in items])
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(items, vectors):
+                future.set_result(vector)
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """
+    bge embeddings from an int8 ONNX graph on onnxruntime (CLS pooling, L2-normalized).
+
+    Texts are sorted by length and batched, so each batch only pads to its own
+    longest text. Concurrent query embeddings are coalesced by a MicroBatcher.
+    """
+
+    _session = PrivateAttr()
+    _tokenizer = PrivateAttr()
+    _input_names = PrivateAttr()
+    _batcher = PrivateAttr()
+
+    def __init__(self, model_name: str, embed_batch_size: int = 32, model_dir: str = None,
+                 threads: int = EMBED_ONNX_THREADS, **kwargs):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        # Distinct name, so cached vectors of the two backends are never mixed up
+        super().__init__(model_name=f"{model_name}-onnx-int8", embed_batch_size=embed_batch_size, **kwargs)
+        model_dir = model_dir or os.path.join(EMBED_ONNX_PATH, re.sub(r"[^A-Za-z0-9._-]", "_", model_name))
+        model_path = export_quantized_model(model_name, model_dir)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=EMBED_MAX_LENGTH)
+        pad_id = tokenizer.token_to_id("[PAD]") or 0
+        tokenizer.enable_padding(pad_id=pad_id, pad_token="[PAD]") # Pads to the longest text of each batch
+        self._tokenizer = tokenizer
+        self._batcher = MicroBatcher(self._encode, max_batch=embed_batch_size)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        results = [None] * len(texts)
+        for start in range(0, len(order), self.embed_batch_size):
+            batch = order[start:start + self.embed_batch_size]
+            encodings = self._tokenizer.encode_batch([texts[i] for i in batch])
+            feed = {
+                "input_ids": np.asarray([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.asarray([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.asarray([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self._session.run(None, {k: v for k, v in feed.items() if k in self._input_names})[0]
+            cls = hidden[:, 0]
+            cls = cls / np.maximum(np.linalg.norm(cls, axis=1, keepdims=True), 1e-12)
+            for i, vector in zip(batch, cls):
+                results[i] = vector.tolist()
+        return results
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._batcher.submit(f"{BGE_QUERY_INSTRUCTION} {query}".strip())
+
+    def get_query_embedding_batch(self, queries: List[str]) -> List[List[float]]:
+        return self._encode([f"{BGE_QUERY_INSTRUCTION} {query}".strip() for query in queries])
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
+
+
+# --- Parity check and benchmark ---
+def sample_texts(passages: int, queries: int):
+    """Chunks from ./db when there is one (first sentences as queries), else the synthetic benchmark corpus."""
+    if os.path.exists("./db"):
+        import chromadb
+        from sharding import open_collection
+        from tools import COLLECTION_NAME
+        collection = open_collection(chromadb.PersistentClient(path="./db"), COLLECTION_NAME)
+        documents = [d for d in collection.get(limit=passages, include=["documents"])["documents"] if d.strip()]
+        if len(documents) >= PARITY_TOP_K:
+            rng = np.random.default_rng(0)
+            picks = rng.choice(len(documents), size=min(queries, len(documents)), replace=False)
+            return documents, [re.split(r"(?<=[.!?])\s", documents[i].strip())[0][:200] for i in picks]
+    import random
+    from benchmark import synthetic_text, benchmark_queries
+    rng = random.Random(0)
+    return [synthetic_text(rng, 1) for _ in range(passages)], benchmark_queries(queries)
+
+
+def parity_check(fp32_model, int8_model, passages: List[str], queries: List[str], top_k: int = PARITY_TOP_K) -> dict:
+    """Compare the int8 model's vectors and rankings with the fp32 model's."""
+    results = {}
+    for name, model in (("fp32", fp32_model), ("int8", int8_model)):
+        results[name] = (np.asarray(model.get_text_embedding_batch(passages), dtype=np.float32),
+                         np.asarray([model.get_query_embedding(q) for q in queries], dtype=np.float32))
+    (p32, q32), (p8, q8) = results["fp32"], results["int8"]
+    cosines = np.sum(p32 * p8, axis=1) / (np.linalg.norm(p32, axis=1) * np.linalg.norm(p8, axis=1))
+    top32 = np.argsort(-(q32 @ p32.T), axis=1)[:, :top_k]
+    top8 = np.argsort(-(q8 @ p8.T), axis=1)[:, :top_k]
+    overlaps = [len(set(a) & set(b)) / top_k for a, b in zip(top32.tolist(), top8.tolist())]
+    report = {
+        "passages": len(passages),
+        "queries": len(queries),
+        "mean_cosine": round(float(cosines.mean()), 4),
+        "min_cosine": round(float(cosines.min()), 4),
+        f"mean_top{top_k}_overlap": round(float(np.mean(overlaps)), 4),
+        "top1_agreement": round(float(np.mean(top32[:, 0] == top8[:, 0])), 4),
+    }
+    report["passed"] = report["mean_cosine"] >= PARITY_MIN_COSINE and report[f"mean_top{top_k}_overlap"] >= PARITY_MIN_OVERLAP
+    return report
+
+
+def bench_backend(backend: str, passages: List[str], queries: List[str]) -> dict:
+    """Load time, throughput, query latency and peak RSS of one backend (run in its own process)."""
+    import embeddings
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    model = embeddings.load_base_model(backend)
+    load_s = time.perf_counter() - started
+    model.get_text_embedding_batch(passages[:8]) # Warm-up
+    started = time.perf_counter()
+    model.get_text_embedding_batch(passages)
+    passages_per_s = len(passages) / (time.perf_counter() - started)
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        model.get_query_embedding(query)
+        latencies.append(time.perf_counter() - started)
+    return {
+        "backend": backend,
+        "load_s": round(load_s, 2),
+        "passages_per_s": round(passages_per_s, 1),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "model_rss_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity check and benchmark of the int8 ONNX embedder.")
+    parser.add_argument("--parity", action="store_true", help="Compare rankings with the fp32 PyTorch model")
+    parser.add_argument("--bench", action="store_true", help="Compare speed and memory of both backends")
+    parser.add_argument("--passages", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--bench-one", help=argparse.SUPPRESS) # Internal: benchmark one backend in this process
+    args = parser.parse_args()
+    from embeddings import EMBED_MODEL_NAME, load_base_model
+    passages, queries = sample_texts(args.passages, args.queries)
+
+    if args.bench_one:
+        print(json.dumps(bench_backend(args.bench_one, passages, queries)))
+        return
+
+    failed = False
+    if args.parity or not args.bench:
+        print(f"🔬 Parity of the int8 ONNX model with fp32 {EMBED_MODEL_NAME} ({len(passages)} passages)...")
+        report = parity_check(load_base_model("torch"), load_base_model("onnx"), passages, queries)
+        for key, value in report.items():
+            print(f"   {key:<20}{value}")
+        print("✅ Parity OK" if report["passed"] else "❌ Rankings drifted too far from the fp32 model")
+        failed = not report["passed"]
+
+    if args.bench:
+        results = {}
+        for backend in ("torch", "onnx"):
+            # One process per backend, so memory is not shared and PyTorch stays out of the ONNX numbers
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--bench-one", backend,
+                                     "--passages", str(args.passages), "--queries", str(args.queries)],
+                                    check=True, capture_output=True, text=True).stdout
+            results[backend] = json.loads(output.strip().splitlines()[-1])
+        torch_result, onnx_result = results["torch"], results["onnx"]
+        print(f"\n{'':<16}{'torch fp32':>12}{'onnx int8':>12}")
+        for key in ("load_s", "passages_per_s", "query_p50_ms", "query_p95_ms", "peak_rss_mb", "model_rss_mb"):
+            print(f"{key:<16}{torch_result[key]:>12}{onnx_result[key]:>12}")
+        print(f"\n⚡ Ingest speedup x{onnx_result['passages_per_s'] / torch_result['passages_per_s']:.2f}, "
+              f"query speedup x{torch_result['query_p50_ms'] / max(onnx_result['query_p50_ms'], 1e-6):.2f}, "
+              f"peak RSS {onnx_result['peak_rss_mb'] - torch_result['peak_rss_mb']:+.0f} MB")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
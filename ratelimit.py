@@ -0,0 +1,140 @@
+import random
+import asyncio
+import threading
+import time
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English), for quotas and prompt budgets."""
+    return len(text) // 4 + 1
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """
+    True for 429 / quota errors from Groq, LlamaCloud or their HTTP clients, judged by the
+    HTTP status or the exception type only: a "429" in a message can be a page number or an id.
+    """
+    if e.__cause__ is not None and is_rate_limit_error(e.__cause__):
+        return True # e.g. SimpleDirectoryReader's "Error loading file" wrapper
+    response = getattr(e, "response", None)
+    for status in (getattr(e, "status_code", None), getattr(e, "status", None), getattr(response, "status_code", None)):
+        if status == 429:
+            return True
+    # groq/openai-style SDKs raise RateLimitError, some HTTP clients TooManyRequests
+    return any(cls.__name__ in ("RateLimitError", "TooManyRequests") for cls in type(e).__mro__)
+
+
+def retry_after_seconds(e: Exception) -> float:
+    """Server-suggested wait from a Retry-After header, or 0 if there is none."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `rate_per_minute` tokens are refilled evenly over
+    a minute, up to `capacity` (defaults to one minute's worth).
+    A 429 can call `penalize()` to pause every caller sharing the bucket.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """Take `amount` tokens if possible. Returns 0 on success, else the seconds to wait."""
+        # A single request larger than the bucket would never fit, so cap it at a full bucket.
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._refill(now)
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate_per_second
+
+    def acquire(self, amount: float = 1):
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, amount: float = 1):
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def adjust(self, amount: float):
+        """Charge (or refund, if negative) tokens after the fact, e.g. once the real usage is known."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+    def penalize(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 30.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def _retry_delay(e: Exception, attempt: int, base_delay: float, max_delay: float) -> float:
+    return max(backoff_delay(attempt, base_delay, max_delay), retry_after_seconds(e))
+
+
+def retry_with_backoff(fn, *args, retries: int = 5, limiter: TokenBucket = None, cost: float = 1,
+                       base_delay: float = 1.0, max_delay: float = 30.0, **kwargs):
+    """
+    Call `fn(*args, **kwargs)` under `limiter`, retrying rate-limit errors with
+    jittered exponential backoff (or the server's Retry-After, if longer).
+    Other errors are raised immediately.
+    """
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire(cost)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries or not is_rate_limit_error(e):
+                raise
+            delay = _retry_delay(e, attempt, base_delay, max_delay)
+            if limiter:
+                limiter.penalize(delay)
+            print(f"⏳ Rate limited, retrying in {delay:.1f}s (attempt {attempt + 1}/{retries})...")
+            time.sleep(delay)
+
+
+async def aretry_with_backoff(fn, *args, retries: int = 5, limiter: TokenBucket = None, cost: float = 1,
+                              base_delay: float = 1.0, max_delay: float = 30.0, **kwargs):
+    """Async version of retry_with_backoff for coroutine functions."""
+    for attempt in range(retries + 1):
+        if limiter:
+            await limiter.acquire_async(cost)
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries or not is_rate_limit_error(e):
+                raise
+            delay = _retry_delay(e, attempt, base_delay, max_delay)
+            if limiter:
+                limiter.penalize(delay)
+            print(f"⏳ Rate limited, retrying in {delay:.1f}s (attempt {attempt + 1}/{retries})...")
+            await asyncio.sleep(delay)
@@ -0,0 +1,154 @@
+import os
+import re
+import threading
+from typing import List, Tuple
+import numpy as np
+
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.6")) # Below this, take the full research path
+ROUTER_CHAT_MIN_SCORE = float(os.getenv("ROUTER_CHAT_MIN_SCORE", "0.8")) # Chit-chat skips retrieval, so be sure
+DEFAULT_INTENT = "summarize" # Full researcher -> reviewer path
+
+# A handful of typical queries per intent; their mean embedding is the intent's centroid
+INTENT_EXAMPLES = {
+    "lookup": [
+        "What is the deadline for the project?",
+        "When was the contract signed?",
+        "What does the acronym stand for?",
+        "How many users were surveyed?",
+        "Define the term used in the report.",
+        "What is the formula for the growth rate?",
+        "Where is the main office located?",
+    ],
+    "summarize": [
+        "Summarize the meeting recording.",
+        "Give me an overview of the documents.",
+        "Explain in detail how the process works.",
+        "What are the key takeaways from the report?",
+        "Summarize the main points of the presentation.",
+        "Describe the overall strategy.",
+    ],
+    "compare": [
+        "Compare the two proposals.",
+        "What is the difference between version 1 and version 2?",
+        "How does plan A differ from plan B?",
+        "Contrast the old and the new approach.",
+        "Which is better, option one or option two?",
+        "Model X vs model Y",
+    ],
+    "attribution": [
+        "Who wrote this poem?",
+        "Which author talks about love?",
+        "Find the source of this quote.",
+        "Which document mentions the budget?",
+        "Who is the creator of this concept?",
+        "In which file is the architecture described?",
+    ],
+    "visualize": [
+        "Visualize this as a flowchart.",
+        "Draw a diagram of the process.",
+        "I don't understand, can you show it visually?",
+        "Make a flowchart of the steps.",
+        "Show me a mind map of these ideas.",
+    ],
+    "chit_chat": [
+        "Hello!",
+        "Hi there, how are you?",
+        "Thanks a lot!",
+        "Good morning",
+        "Who are you?",
+        "Bye, see you later.",
+        "That was helpful, thank you.",
+    ],
+}
+
+# Explicit commands are routed without asking the model
+KEYWORD_INTENTS = [
+    (re.compile(r"\b(visuali[sz]e|flowchart|mermaid|diagram)\b|don't understand", re.IGNORECASE), "visualize"),
+]
+
+_COMPARE_PATTERNS = [
+    re.compile(r"difference(?:s)?\s+between\s+(?P<entities>.+)", re.IGNORECASE),
+    re.compile(r"(?:compare|comparing|comparison\s+of|contrast)\s+(?P<entities>.+)", re.IGNORECASE),
+    re.compile(r"(?P<entities>.+\s(?:vs\.?|versus)\s.+)", re.IGNORECASE),
+]
+_ENTITY_SEPARATORS = re.compile(r"\s*(?:,\s*(?:and\s+)?|\s+and\s+|\s+vs\.?\s+|\s+versus\s+|\s+with\s+|\s+to\s+)\s*",
+                                re.IGNORECASE)
+
+
+def extract_entities(query: str) -> List[str]:
+    """The things a compare query is about: "Compare A, B and C" -> ["A", "B", "C"]. Empty if unclear."""
+    for pattern in _COMPARE_PATTERNS:
+        match = pattern.search(query)
+        if match:
+            entities = _ENTITY_SEPARATORS.split(match.group("entities").strip(" ?.!"))
+            entities = [re.sub(r"^(?:the|a|an)\s+", "", e.strip(" ?.!'\""), flags=re.IGNORECASE) for e in entities]
+            entities = list(dict.fromkeys(e for e in entities if e))
+            if len(entities) >= 2:
+                return entities
+    return []
+
+
+class IntentRouter:
+    """
+    Nearest-centroid intent classifier over the local bge query embeddings.
+
+    Centroids are the normalized mean embeddings of INTENT_EXAMPLES, computed
+    once per process (and kept in the embedding cache on disk). Classifying a
+    question embeds it once, which the retriever then gets back from the cache,
+    plus one small matrix product.
+    """
+
+    def __init__(self, embed_model=None):
+        self._embed_model = embed_model
+        self._lock = threading.Lock()
+        self._intents = list(INTENT_EXAMPLES)
+        self._centroids = None
+
+    def _model(self):
+        from embeddings import get_embed_model # Imported on first use, like the model itself
+        return self._embed_model or get_embed_model()
+
+    def warm_up(self):
+        with self._lock:
+            if self._centroids is None:
+                embed_model = self._model()
+                centroids = []
+                for intent in self._intents:
+                    vectors = np.asarray([embed_model.get_query_embedding(q) for q in INTENT_EXAMPLES[intent]],
+                                         dtype=np.float32)
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                    centroid = vectors.mean(axis=0)
+                    centroids.append(centroid / np.linalg.norm(centroid))
+                self._centroids = np.stack(centroids)
+        return self._centroids
+
+    def classify(self, query: str) -> Tuple[str, float]:
+        """Returns (intent, score). Low-confidence queries get DEFAULT_INTENT."""
+        for pattern, intent in KEYWORD_INTENTS:
+            if pattern.search(query):
+                return intent, 1.0
+        centroids = self.warm_up()
+        embed_model = self._model()
+        vector = np.asarray(embed_model.get_query_embedding(query), dtype=np.float32)
+        scores = centroids @ (vector / (np.linalg.norm(vector) or 1.0))
+        best = int(np.argmax(scores))
+        intent, score = self._intents[best], float(scores[best])
+        if score < ROUTER_MIN_SCORE or (intent == "chit_chat" and score < ROUTER_CHAT_MIN_SCORE):
+            return DEFAULT_INTENT, score
+        if intent == "compare" and not extract_entities(query):
+            return DEFAULT_INTENT, score # Nothing to fan out over
+        return intent, score
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> IntentRouter:
+    """Return the process-wide intent router, creating it on first use."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = IntentRouter()
+    return _router
@@ -0,0 +1,175 @@
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from filters import DEFAULT_SOURCE_TYPE
+
+SHARD_BY_SOURCE = os.getenv("SHARD_BY_SOURCE", "0") == "1" # One Chroma collection per source type
+SHARD_SEPARATOR = "__"
+
+
+def shard_name(collection_name: str, source_type: str) -> str:
+    return f"{collection_name}{SHARD_SEPARATOR}{source_type}"
+
+
+def _collection_names(client) -> List[str]:
+    # Names or Collection objects, depending on the Chroma version
+    return [getattr(c, "name", c) for c in client.list_collections()]
+
+
+def collection_layout(client, collection_name: str) -> Optional[str]:
+    """'single', 'sharded' or None (nothing ingested yet)."""
+    names = _collection_names(client)
+    if any(n.startswith(collection_name + SHARD_SEPARATOR) for n in names):
+        return "sharded"
+    return "single" if collection_name in names else None
+
+
+def drop_collections(client, collection_name: str):
+    """Delete the collection and all of its shards."""
+    for name in _collection_names(client):
+        if name == collection_name or name.startswith(collection_name + SHARD_SEPARATOR):
+            client.delete_collection(name)
+
+
+def open_collection(client, collection_name: str, sharded: bool = None, create: bool = False):
+    """
+    The plain collection, or a ShardedCollection when the database is sharded.
+    `sharded=None` follows what is on disk (readers); ingest passes SHARD_BY_SOURCE.
+    """
+    if sharded is None:
+        sharded = collection_layout(client, collection_name) == "sharded"
+    if sharded:
+        return ShardedCollection(client, collection_name)
+    if create:
+        return client.get_or_create_collection(collection_name)
+    return client.get_collection(collection_name)
+
+
+def _shard_source_types(where: Optional[dict]) -> Optional[set]:
+    """Source types a `where` clause limits the search to (None = all shards)."""
+    if not where:
+        return None
+    clauses = where.get("$and", [where])
+    for clause in clauses:
+        condition = clause.get("source_type")
+        if isinstance(condition, str):
+            return {condition}
+        if isinstance(condition, dict):
+            if "$eq" in condition:
+                return {condition["$eq"]}
+            if "$in" in condition:
+                return set(condition["$in"])
+    return None
+
+
+class ShardedCollection:
+    """
+    Chroma collection facade over one collection per source type
+    ("project_knowledge__pdf", "project_knowledge__audio", ...).
+
+    Writes go to the shard of each chunk's `source_type`. Queries run on the
+    shards the `where` clause allows (all others are skipped), in parallel, and
+    are merged by distance. Implements the subset of the Collection API that
+    ingest.py, indexing.py, lexical_index.py and tools.py use.
+    """
+
+    def __init__(self, client, collection_name: str):
+        self.client = client
+        self.name = collection_name
+        self._shards: Dict[str, object] = {}
+        prefix = collection_name + SHARD_SEPARATOR
+        for name in sorted(_collection_names(client)):
+            if name.startswith(prefix):
+                self._shards[name[len(prefix):]] = client.get_collection(name)
+
+    @property
+    def shards(self) -> Dict[str, object]:
+        return dict(self._shards)
+
+    @property
+    def metadata(self):
+        return next(iter(self._shards.values())).metadata if self._shards else None
+
+    def _shard(self, source_type: str):
+        if source_type not in self._shards:
+            self._shards[source_type] = self.client.get_or_create_collection(shard_name(self.name, source_type))
+        return self._shards[source_type]
+
+    def _selected(self, where: Optional[dict]) -> list:
+        source_types = _shard_source_types(where)
+        return [c for t, c in self._shards.items() if source_types is None or t in source_types]
+
+    def count(self) -> int:
+        return sum(c.count() for c in self._shards.values())
+
+    def _grouped(self, ids, metadatas, *columns):
+        groups = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault((metadata or {}).get("source_type") or DEFAULT_SOURCE_TYPE, []).append(i)
+        for source_type, rows in groups.items():
+            yield self._shard(source_type), [ids[i] for i in rows], [metadatas[i] for i in rows], \
+                  [[column[i] for i in rows] if column is not None else None for column in columns]
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        for shard, shard_ids, shard_metadatas, (shard_embeddings, shard_documents) in \
+                self._grouped(ids, metadatas, embeddings, documents):
+            shard.upsert(ids=shard_ids, embeddings=shard_embeddings, metadatas=shard_metadatas,
+                         documents=shard_documents)
+
+    def update(self, ids, metadatas):
+        for shard, shard_ids, shard_metadatas, _ in self._grouped(ids, metadatas):
+            shard.update(ids=shard_ids, metadatas=shard_metadatas)
+
+    def delete(self, ids=None, where=None):
+        for shard in self._selected(where):
+            shard.delete(ids=ids, where=where)
+
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), limit=None, offset=None):
+        """Rows from every allowed shard, in shard order (so limit/offset page through all of them)."""
+        result = {"ids": [], **{key: [] for key in include}}
+        skip = offset or 0
+        for shard in self._selected(where):
+            if limit is not None and len(result["ids"]) >= limit:
+                break
+            if skip and ids is None and where is None:
+                size = shard.count()
+                if skip >= size: # Whole shard is before the page
+                    skip -= size
+                    continue
+            wanted = None if limit is None else limit - len(result["ids"]) + skip
+            page = shard.get(ids=ids, where=where, include=list(include), limit=wanted)
+            start = min(skip, len(page["ids"]))
+            skip -= start
+            result["ids"].extend(page["ids"][start:])
+            for key in include:
+                if page.get(key) is not None:
+                    result[key].extend(page[key][start:])
+        return result
+
+    def query(self, query_embeddings, n_results, where=None, include=("metadatas", "documents", "distances")):
+        """Top `n_results` over the allowed shards, searched in parallel and merged by distance."""
+        shards = self._selected(where)
+        empty = {"ids": [[]], **{key: [[]] for key in include}}
+        if not shards:
+            return empty
+
+        def search(shard):
+            return shard.query(query_embeddings=query_embeddings, n_results=min(n_results, max(shard.count(), 1)),
+                               where=where, include=list(include) + (["distances"] if "distances" not in include else []))
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            # copy_context() (taken here, in the caller's thread) keeps any tracing span of the caller
+            futures = [pool.submit(contextvars.copy_context().run, search, shard) for shard in shards]
+            pages = [future.result() for future in futures]
+        rows = []
+        for page in pages:
+            for i in range(len(page["ids"][0])):
+                rows.append((page["distances"][0][i], page, i))
+        rows.sort(key=lambda row: row[0])
+        merged = empty
+        for _, page, i in rows[:n_results]:
+            merged["ids"][0].append(page["ids"][0][i])
+            for key in include:
+                merged[key][0].append(page[key][0][i])
+        return merged
@@ -1,95 +1,206 @@
-import streamlit as st
-import os
-import nest_asyncio
-nest_asyncio.apply()
-from langchain_core.messages import HumanMessage, AIMessage
-from graph import app
-
-# --- Page Config ---
-st.set_page_config(
-    page_title="Multimodal RAG Agent",
-    page_icon="🤖",
-    layout="wide"
-)
-
-# --- Header ---
-st.title("🤖 Multimodal RAG Agent")
-st.markdown("Query your PDFs, Images, Audio, and PPTs using an intelligent multi-agent system.")
-
-# --- Session State for History ---
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
-# --- Custom CSS for Chat Interface ---
-st.markdown("""
-<style>
-.stChatMessage {
-    padding: 1rem;
-    border-radius: 0.5rem;
-    margin-bottom: 0.5rem;
-}
-</style>
-""", unsafe_allow_html=True)
-
-# --- Display History ---
-for msg in st.session_state.messages:
-    if isinstance(msg, HumanMessage):
-        with st.chat_message("user"):
-            st.markdown(msg.content)
-    elif isinstance(msg, AIMessage):
-        with st.chat_message("assistant"):
-            st.markdown(msg.content)
-
-# --- Input Box ---
-user_input = st.chat_input("Ask about your documents...")
-
-if user_input:
-    # 1. Display User Message
-    with st.chat_message("user"):
-        st.markdown(user_input)
-    st.session_state.messages.append(HumanMessage(content=user_input))
-
-    # 2. Run Agent Graph
-    initial_state = {"messages": st.session_state.messages, "next_step": ""}
-    
-    with st.spinner("🤖 Agent is thinking... (Researching & Reviewing)"):
-        try:
-            result = app.invoke(initial_state)
-            
-            # 3. Get Final Response
-            final_msg_obj = result["messages"][-1]
-            final_content = final_msg_obj.content
-            
-            # 4. Display AI Response
-            with st.chat_message("assistant"):
-                st.markdown(final_content)
-                
-                # Check for Mermaid Code
-                if "graph TD" in final_content or "graph LR" in final_content:
-                    st.info("🎨 Flowchart detected above. Rendering...")
-                    # Basic Markdown rendering (Streamlit supports mermaid in st.markdown as of recent updates usually, 
-                    # but if not, user sees code block which is fine for 'simple')
-            
-            # 5. Update History
-            # We append the result to session state carefully to avoid duplicates if langgraph returns full history
-            # But simpler is just to append the final AIMessage
-            st.session_state.messages.append(final_msg_obj)
-            
-        except Exception as e:
-            st.error(f"❌ Error during execution: {e}")
-
-# --- Sidebar ---
-with st.sidebar:
-    st.header("📂 Data Status")
-    if os.path.exists("./db"):
-        st.success("Vector Database Found")
-    else:
-        st.warning("Vector Database Missing!")
-        st.info("Please run `ingest.py` first.")
-    
-    st.header("⚙️ Configuration")
-    st.code(f"Model: Llama 3.3 (Groq)\nEmbeddings: Local (BGE)\nAgents: Researcher, Reviewer, Visualizer", language="text")
-
-    if st.button("🧹 Clear Chat History"):
-        st.session_state.messages = []
-        st.rerun()
+import streamlit as st
+import os
+import re
+import asyncio
+import threading
+from datetime import datetime
+import nest_asyncio
+nest_asyncio.apply()
+from langchain_core.messages import HumanMessage, AIMessage
+from graph import astream_answer, warm_up, get_app, WARM_UP
+from tools import get_retriever
+from memory import ConversationMemory
+from tracing import tracer, start_metrics_server
+from filters import RetrievalFilter, SOURCE_TYPES, DEFAULT_SOURCE_TYPE
+
+# --- Page Config ---
+st.set_page_config(
+    page_title="Multimodal RAG Agent",
+    page_icon="🤖",
+    layout="wide"
+)
+
+# --- Shared Agent (one embedding model, Chroma client and compiled graph per process, reused across reruns and sessions) ---
+@st.cache_resource(show_spinner="⬇️ Loading knowledge base...")
+def load_agent():
+    warm_up() # Returns at once if the background warm-up got there first
+    return get_app()
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    return warm_up(background=True) # The page renders while the models load
+
+if WARM_UP == "background":
+    start_warm_up()
+elif WARM_UP == "blocking":
+    load_agent()
+
+# --- Shared Event Loop (every session's graph runs on it, so they share the async Groq client and its quota) ---
+@st.cache_resource
+def load_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="graph-loop", daemon=True).start()
+    return loop
+
+async def _await(awaitable):
+    return await awaitable
+
+def answer_events(state: dict):
+    """astream_answer run on the shared loop, its events handed to this script thread (which owns the widgets)."""
+    loop = load_event_loop()
+    events = astream_answer(state)
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(_await(events.__anext__()), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(_await(events.aclose()), loop).result()
+
+@st.cache_resource
+def load_metrics_server():
+    return start_metrics_server() # Only if METRICS_PORT is set
+
+load_metrics_server()
+
+def scope_filters() -> dict:
+    """Retrieval scope picked in the sidebar, passed to the graph as explicit filters."""
+    scope = RetrievalFilter(
+        file_names=st.session_state.get("scope_files", []),
+        source_types=st.session_state.get("scope_types", []),
+        tags=[t for t in re.split(r"[,\s]+", st.session_state.get("scope_tags", "")) if t],
+    )
+    since = st.session_state.get("scope_since")
+    if since:
+        scope.ingested_after = datetime.combine(since, datetime.min.time()).timestamp()
+    return scope.to_dict()
+
+# --- Header ---
+st.title("🤖 Multimodal RAG Agent")
+st.markdown("Query your PDFs, Images, Audio, and PPTs using an intelligent multi-agent system.")
+
+# --- Session State for History ---
+if "messages" not in st.session_state:
+    st.session_state.messages = [] # Full transcript, for display only
+if "memory" not in st.session_state:
+    st.session_state.memory = ConversationMemory() # Bounded window + summary, sent to the graph
+
+# --- Custom CSS for Chat Interface ---
+st.markdown("""
+<style>
+.stChatMessage {
+    padding: 1rem;
+    border-radius: 0.5rem;
+    margin-bottom: 0.5rem;
+}
+</style>
+""", unsafe_allow_html=True)
+
+# --- Display History ---
+for msg in st.session_state.messages:
+    if isinstance(msg, HumanMessage):
+        with st.chat_message("user"):
+            st.markdown(msg.content)
+    elif isinstance(msg, AIMessage):
+        with st.chat_message("assistant"):
+            st.markdown(msg.content)
+
+# --- Input Box ---
+user_input = st.chat_input("Ask about your documents...")
+
+if user_input:
+    # 1. Display User Message
+    with st.chat_message("user"):
+        st.markdown(user_input)
+    st.session_state.messages.append(HumanMessage(content=user_input))
+
+    # 2. Run Agent Graph
+    initial_state = {**st.session_state.memory.to_state(user_input), "next_step": "", "filters": scope_filters()}
+    
+    with st.chat_message("assistant"):
+        status = st.status("🤖 Agent is thinking... (Researching & Reviewing)")
+        answer_box = st.empty()
+        try:
+            load_agent() # Waits for whatever the warm-up has not loaded yet
+            # 3. Stream progress + tokens; the draft is shown until the reviewed answer starts
+            result = None
+            draft, final_content = "", ""
+            for event, payload in answer_events(initial_state):
+                if event == "progress":
+                    status.write(payload)
+                elif event == "draft_token":
+                    draft += payload
+                    answer_box.markdown(draft + " ▌")
+                elif event == "token":
+                    final_content += payload
+                    answer_box.markdown(final_content + " ▌")
+                elif event == "final":
+                    result = payload
+            status.update(label="✅ Done", state="complete")
+
+            # 4. Display AI Response
+            final_content = result["final_answer"]
+            answer_box.markdown(final_content)
+                
+            # Check for Mermaid Code
+            if "graph TD" in final_content or "graph LR" in final_content:
+                st.info("🎨 Flowchart detected above. Rendering...")
+                # Basic Markdown rendering (Streamlit supports mermaid in st.markdown as of recent updates usually, 
+                # but if not, user sees code block which is fine for 'simple')
+            
+            # 5. Update History
+            st.session_state.messages.append(AIMessage(content=final_content))
+            st.session_state.memory.add_turn(user_input, final_content)
+            st.session_state.last_trace_id = result["trace_id"]
+            
+        except Exception as e:
+            status.update(label="❌ Failed", state="error")
+            st.error(f"❌ Error during execution: {e}")
+
+# --- Sidebar ---
+with st.sidebar:
+    st.header("📂 Data Status")
+    if os.path.exists("./db"):
+        st.success("Vector Database Found")
+    else:
+        st.warning("Vector Database Missing!")
+        st.info("Please run `ingest.py` first.")
+    
+    st.header("⚙️ Configuration")
+    st.code(f"Model: Llama 3.3 (Groq)\nEmbeddings: Local (BGE)\nAgents: Researcher, Reviewer, Visualizer", language="text")
+
+    st.header("🎯 Scope")
+    try:
+        known_files = sorted({os.path.basename(f) for f in get_retriever().known_files()}) if os.path.exists("./db") else []
+    except Exception:
+        known_files = []
+    st.multiselect("Source types", [*SOURCE_TYPES, DEFAULT_SOURCE_TYPE], key="scope_types")
+    st.multiselect("Files", known_files, key="scope_files")
+    st.text_input("Tags", key="scope_tags", placeholder="finance, legal")
+    st.date_input("Added since", value=None, key="scope_since")
+    st.caption('Questions can name their scope too: "in the Q3 deck", "from the audio recordings", "#finance".')
+
+    st.header("⏱️ Last Request")
+    spans = tracer.get_trace(st.session_state.get("last_trace_id")) if st.session_state.get("last_trace_id") else []
+    if spans:
+        depth = {}
+        rows = []
+        for span in spans:
+            depth[span["span_id"]] = depth.get(span["parent_id"], -1) + 1
+            rows.append({
+                "step": "· " * depth[span["span_id"]] + span["name"],
+                "ms": round(span["duration_s"] * 1000),
+                "tokens in/out": f"{span.get('prompt_tokens', 0)}/{span.get('completion_tokens', 0)}"
+                                 if "prompt_tokens" in span else "",
+                "chunks": span.get("chunks", ""),
+                "context KB": round(span["context_bytes"] / 1024, 1) if "context_bytes" in span else "",
+            })
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+    else:
+        st.caption("Ask a question to see where the time goes.")
+
+    if st.button("🧹 Clear Chat History"):
+        st.session_state.messages = []
+        st.session_state.memory.clear()
+        st.rerun()
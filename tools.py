@@ -1,34 +1,329 @@
-import chromadb
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.core import VectorStoreIndex, Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-
-def search_knowledge_base(query: str):
-    """
-    Tools that searches the project documentation for answers.
-    """
-    # --- SETUP LOCAL EMBEDDINGS (Must match ingest.py) ---
-    embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
-    Settings.embed_model = embed_model
-    Settings.llm = None # FORCE DISABLE OPENAI
-    # -----------------------------------------------------
-
-    # 1. Connect to existing DB
-    db = chromadb.PersistentClient(path="./db")
-    chroma_collection = db.get_collection("project_knowledge")
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    
-    # 2. Create Index from existing vectors
-    index = VectorStoreIndex.from_vector_store(
-        vector_store
-    )
-    
-    # 3. Create Query Engine
-    # 4. Create Query Engine (no external LLM usage)
-    try:
-        # Walkthrough Update: Deep search (Top-15) for holistic coverage
-        query_engine = index.as_query_engine(similarity_top_k=15)
-        response = query_engine.query(query)
-        return str(response)
-    except Exception as e:
-        return f"(Error during retrieval): {e}"
\ No newline at end of file
+import os
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List
+import numpy as np
+from lexical_index import LexicalIndex
+from filters import RetrievalFilter
+from sharding import open_collection
+from audio_segments import format_timestamp
+from ratelimit import estimate_tokens
+from tracing import tracer, traced
+
+# chromadb, llama_index and the embedding model are imported where first used, so that
+# importing this module (and graph.py) stays cheap and the UI comes up before they load.
+if TYPE_CHECKING:
+    from llama_index.core.schema import NodeWithScore
+
+DB_PATH = "./db"
+COLLECTION_NAME = "project_knowledge"
+SIMILARITY_TOP_K = 15 # Candidates taken from each of the vector and BM25 searches
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "8")) # Chunks kept after rank fusion
+RRF_K = 60 # Reciprocal rank fusion constant
+LEXICAL_RESCUE_RANK = 3 # Top BM25 hits survive the similarity cutoff (exact names, formulas, files)
+SIMILARITY_CUTOFF = float(os.getenv("SIMILARITY_CUTOFF", "0.5")) # Min cosine similarity of a chunk to the query
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500")) # Max tokens of context per prompt
+DUPLICATE_CONTAINMENT = 0.8 # Drop a chunk when this share of its word 8-grams is already in the context
+
+
+@dataclass
+class RetrievalResult:
+    context: str
+    nodes: List["NodeWithScore"] = field(default_factory=list) # Chunks packed into `context`, best first
+    query_embedding: List[float] = field(default_factory=list)
+    kb_version: tuple = None # Changes whenever ./db is rewritten
+    filters: RetrievalFilter = None # Scope the chunks were retrieved from (None = everything)
+
+    @property
+    def node_ids(self) -> List[str]:
+        return [n.node.node_id for n in self.nodes]
+
+
+# --- Context Packing ---
+def _shingles(text: str, n: int = 8) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+def deduplicate_nodes(nodes: List["NodeWithScore"]) -> List["NodeWithScore"]:
+    """
+    Remove repeated text from a best-first list of chunks.
+    Chunks of the same document that overlap (the splitter's chunk_overlap) are trimmed
+    to their new part using their character offsets; chunks whose text is already
+    mostly present (e.g. the same file ingested under two names) are dropped.
+    """
+    from llama_index.core.schema import NodeWithScore, MetadataMode
+    kept, seen_shingles = [], set()
+    covered = {} # ref_doc_id -> [(start, end)] already in the context
+    for scored in nodes:
+        node = scored.node
+        text = node.get_content(metadata_mode=MetadataMode.NONE)
+        start, end = node.start_char_idx, node.end_char_idx
+        if node.ref_doc_id and start is not None and end is not None:
+            for kept_start, kept_end in covered.get(node.ref_doc_id, []):
+                if kept_start <= start and end <= kept_end:
+                    text = ""
+                elif kept_start <= start < kept_end:
+                    text, start = text[kept_end - start:], kept_end
+                elif kept_start < end <= kept_end:
+                    text, end = text[:kept_start - start], kept_start
+            covered.setdefault(node.ref_doc_id, []).append((start, end))
+        shingles = _shingles(text)
+        if not text.strip() or len(shingles & seen_shingles) >= DUPLICATE_CONTAINMENT * len(shingles):
+            continue
+        seen_shingles |= shingles
+        if text != node.get_content(metadata_mode=MetadataMode.NONE):
+            node = node.model_copy()
+            node.set_content(text)
+        kept.append(NodeWithScore(node=node, score=scored.score))
+    return kept
+
+def format_source(node) -> str:
+    metadata = node.metadata
+    source = metadata.get("file_name") or os.path.basename(metadata.get("file_path", "")) or "unknown"
+    if metadata.get("start_s") not in (None, ""): # Audio passage: cite its time range
+        end = metadata.get("end_s")
+        end = f"–{format_timestamp(float(end))}" if end not in (None, "") else ""
+        return f"{source}, {format_timestamp(float(metadata['start_s']))}{end}"
+    page = metadata.get("page_label") or metadata.get("source")
+    return f"{source}, page {page}" if page and str(page) != source else source
+
+def pack_context(nodes: List["NodeWithScore"], token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Concatenate chunks (best first) with their sources until `token_budget` is used.
+    Returns (context, packed_nodes). The last chunk is cut short rather than dropped.
+    """
+    from llama_index.core.schema import MetadataMode
+    parts, packed, used = [], [], 0
+    for scored in nodes:
+        header = f"[Source: {format_source(scored.node)} | relevance {scored.score:.2f}]"
+        text = scored.node.get_content(metadata_mode=MetadataMode.NONE).strip()
+        cost = estimate_tokens(header) + estimate_tokens(text)
+        if used + cost > token_budget:
+            remaining_chars = (token_budget - used - estimate_tokens(header)) * 4
+            if remaining_chars < 400: # Not worth a fragment
+                break
+            text = text[:remaining_chars].rsplit(" ", 1)[0] + " ..."
+            cost = token_budget - used
+        parts.append(f"{header}\n{text}")
+        packed.append(scored)
+        used += cost
+    return "\n\n".join(parts), packed
+
+
+class KnowledgeBaseRetriever:
+    """
+    Long-lived retriever shared by the graph, the CLI and the Streamlit app.
+
+    The (cached) embedding model is loaded once per process. The Chroma client and the
+    index are opened lazily and reopened when ./db changes on disk, so a
+    re-run of ingest.py is picked up without restarting the process.
+
+    The lock only guards those handles: searches run outside it, on the handles they
+    took, and a reopen waits until no search is still using the old ones.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, collection_name: str = COLLECTION_NAME,
+                 similarity_top_k: int = SIMILARITY_TOP_K):
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self.similarity_top_k = similarity_top_k
+        self._lock = threading.Condition()
+        self._in_use = 0 # Searches running on the current handles
+        self._embed_model = None
+        self._client = None
+        self._collection = None
+        self._lexical_index = None
+        self._known_files = None
+        self._db_version = None
+
+    def _current_db_version(self):
+        # Chroma writes through SQLite (and its WAL), so their stat changes on every ingest.
+        version = []
+        for name in ("chroma.sqlite3", "chroma.sqlite3-wal"):
+            try:
+                stat = os.stat(os.path.join(self.db_path, name))
+                version.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                version.append(None)
+        return tuple(version)
+
+    def _load_embed_model(self):
+        if self._embed_model is None:
+            from embeddings import get_embed_model
+            self._embed_model = get_embed_model() # Must match ingest.py (thread-safe, loads once)
+        return self._embed_model
+
+    def _open_collection(self):
+        import chromadb
+        # Release only our own client: Chroma shares one System per path and stops it when its
+        # last client closes, so we get a fresh one back unless another client here still uses it.
+        if self._client is not None:
+            self._client.close()
+        self._client = chromadb.PersistentClient(path=self.db_path)
+        return open_collection(self._client, self.collection_name) # Sharded per source type if ingest made it so
+
+    def _refresh_locked(self):
+        version = self._current_db_version()
+        if self._collection is None or version != self._db_version:
+            if self._collection is not None:
+                print("🔄 Knowledge base changed on disk, reopening ./db ...")
+                self._lock.wait_for(lambda: self._in_use == 0) # The old handles are closed below
+                self._lexical_index.close()
+            self._collection = self._open_collection()
+            self._lexical_index = LexicalIndex(self.db_path)
+            self._known_files = None
+            # Opening the client touches chroma.sqlite3 itself, so take the version afterwards
+            self._db_version = self._current_db_version()
+        return self._collection
+
+    @contextmanager
+    def _handles(self):
+        """(collection, lexical_index), kept open until the block ends. Only the lookup holds the lock."""
+        with self._lock:
+            collection = self._refresh_locked()
+            lexical_index = self._lexical_index
+            self._in_use += 1
+        try:
+            yield collection, lexical_index
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._lock.notify_all()
+
+    @staticmethod
+    def _to_similarity(collection, distance: float) -> float:
+        # bge vectors are unit length: squared L2 = 2 - 2cos, cosine/ip distance = 1 - cos
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        return 1.0 - distance / 2.0 if space == "l2" else 1.0 - distance
+
+    @staticmethod
+    def _to_node(node_id: str, text: str, metadata: dict):
+        from llama_index.core.vector_stores.utils import metadata_dict_to_node
+        node = metadata_dict_to_node(metadata, text=text)
+        node.id_ = node_id
+        return node
+
+    def warm_up(self):
+        """Load the embedding model and open ./db ahead of the first question."""
+        with self._lock:
+            self._refresh_locked()
+        self._load_embed_model() # Outside the lock: known_files() need not wait for the model
+
+    def known_files(self) -> List[str]:
+        """Paths of the ingested files (for matching file names mentioned in questions)."""
+        with self._lock:
+            self._refresh_locked()
+            if self._known_files is None:
+                self._known_files = self._lexical_index.file_paths()
+            return self._known_files
+
+    @traced("vector_search")
+    def vector_search(self, query_embedding: List[float], top_k: int, where: dict = None) -> List["NodeWithScore"]:
+        """Top-k chunks from Chroma, scored by cosine similarity. `where` is pushed down to Chroma."""
+        from llama_index.core.schema import NodeWithScore
+        with self._handles() as (collection, _):
+            results = collection.query(query_embeddings=[query_embedding], n_results=top_k, where=where,
+                                       include=["documents", "metadatas", "distances"])
+        return [
+            NodeWithScore(node=self._to_node(node_id, text, metadata), score=self._to_similarity(collection, distance))
+            for node_id, text, metadata, distance in zip(results["ids"][0], results["documents"][0],
+                                                         results["metadatas"][0], results["distances"][0])
+        ]
+
+    @traced("lexical_search")
+    def lexical_search(self, query: str, query_embedding: List[float], top_k: int,
+                       filters: RetrievalFilter = None) -> List["NodeWithScore"]:
+        """
+        Top-k chunks by BM25, loaded from Chroma and scored by cosine similarity like vector hits.
+        `filters` is applied inside the lexical index, which stores the same filter metadata.
+        """
+        from llama_index.core.schema import NodeWithScore
+        with self._handles() as (collection, lexical_index):
+            hits = [node_id for node_id, _ in lexical_index.search(query, top_k, filters=filters)]
+            if not hits:
+                return []
+            found = collection.get(ids=hits, include=["documents", "metadatas", "embeddings"])
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        by_id = {
+            node_id: NodeWithScore(node=self._to_node(node_id, text, metadata),
+                                   score=float(np.dot(np.asarray(embedding, dtype=np.float32), query_vector)))
+            for node_id, text, metadata, embedding in zip(found["ids"], found["documents"],
+                                                          found["metadatas"], found["embeddings"])
+        }
+        return [by_id[node_id] for node_id in hits if node_id in by_id] # Keep BM25 order
+
+    def hybrid_search(self, query: str, query_embedding: List[float],
+                      filters: RetrievalFilter = None) -> List["NodeWithScore"]:
+        """
+        Vector and BM25 candidates merged with reciprocal rank fusion, best first.
+        Chunks below SIMILARITY_CUTOFF are dropped unless BM25 ranks them near the top.
+        """
+        where = filters.to_where() if filters else None
+        vector_hits = self.vector_search(query_embedding, self.similarity_top_k, where)
+        lexical_hits = self.lexical_search(query, query_embedding, self.similarity_top_k, filters)
+        fused, nodes = {}, {}
+        for hits in (vector_hits, lexical_hits):
+            for rank, scored in enumerate(hits):
+                fused[scored.node.node_id] = fused.get(scored.node.node_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+                nodes[scored.node.node_id] = scored
+        lexical_top = {scored.node.node_id for scored in lexical_hits[:LEXICAL_RESCUE_RANK]}
+        ranked = sorted(fused, key=fused.get, reverse=True)
+        kept = [nodes[i] for i in ranked if nodes[i].score >= SIMILARITY_CUTOFF or i in lexical_top]
+        return kept[:HYBRID_TOP_K]
+
+    def retrieve(self, query: str, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 filters: RetrievalFilter = None) -> RetrievalResult:
+        """
+        Scored chunks for `query` from hybrid (vector + BM25) search, de-duplicated
+        and packed into at most `token_budget` tokens of source-labelled context.
+        Only chunks matching `filters` (file names, source types, dates, tags) are considered.
+        """
+        where = filters.to_where() if filters else None
+        with tracer.span("retrieve") as span:
+            if where:
+                span.set(filter=filters.describe())
+            # Embedding is the slow part and does not touch Chroma, so it runs outside the lock.
+            embed_model = self._load_embed_model()
+            with tracer.span("embed_query"):
+                query_embedding = embed_model.get_query_embedding(query)
+            relevant = self.hybrid_search(query, query_embedding, filters if where else None)
+            kb_version = self._db_version
+            context, packed = pack_context(deduplicate_nodes(relevant), token_budget)
+            span.set(candidates=len(relevant), chunks=len(packed), context_bytes=len(context.encode("utf-8")))
+        return RetrievalResult(
+            context=context or "(No relevant passages found in the knowledge base.)",
+            nodes=packed,
+            query_embedding=query_embedding,
+            kb_version=kb_version,
+            filters=filters if where else None,
+        )
+
+    def search(self, query: str) -> str:
+        return self.retrieve(query).context
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever() -> KnowledgeBaseRetriever:
+    """Return the process-wide retriever, creating it on first use."""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = KnowledgeBaseRetriever()
+    return _retriever
+
+
+@traced("search_knowledge_base")
+def search_knowledge_base(query: str):
+    """
+    Tools that searches the project documentation for answers.
+    """
+    try:
+        return get_retriever().search(query)
+    except Exception as e:
+        return f"(Error during retrieval): {e}"
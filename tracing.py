@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import uuid
+import inspect
+import functools
+import threading
+import contextvars
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+TRACE_JSONL = os.getenv("TRACE_JSONL", "") # Append every finished span here as a JSON line (off if empty)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "5000")) # Spans kept in memory for the UI
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Serve Prometheus metrics on this port (off if 0)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Numeric span attributes that are summed into Prometheus counters
+COUNTERS = ("prompt_tokens", "completion_tokens", "chunks", "context_bytes", "retries")
+# ...and the ones a finished span also adds to its parent (so a node span shows its LLM tokens)
+ROLLUP = ("prompt_tokens", "completion_tokens", "retries")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation. Attributes hold tokens, chunk counts, context bytes, etc."""
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.attributes = dict(attributes)
+        self._lock = threading.Lock() # Children in parallel threads (compare sides, shards) roll up concurrently
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add(self, key: str, amount):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            attributes = dict(self.attributes)
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "duration_s": self.duration,
+            "error": self.error,
+            **attributes,
+        }
+
+
+class Tracer:
+    """
+    Collects spans for the agent graph, retrieval, LLM calls and ingestion.
+
+    The current span lives in a context variable, so spans nest across LangGraph's
+    worker threads and asyncio tasks without passing anything around. Finished
+    spans go to an in-memory ring buffer (for the Streamlit panel), optionally to a
+    JSON-lines file, and into per-name aggregates served in Prometheus text format.
+    """
+
+    def __init__(self, jsonl_path: str = TRACE_JSONL, buffer_size: int = TRACE_BUFFER_SIZE):
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=buffer_size)
+        self._metrics = defaultdict(lambda: {
+            "count": 0, "sum": 0.0, "errors": 0, "buckets": [0] * len(LATENCY_BUCKETS),
+            **{key: 0 for key in COUNTERS},
+        })
+        self._jsonl = None
+        self.last_trace_id = None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                _current_span.set(span.parent) # Generator resumed in another context
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        span.duration = time.perf_counter() - span._started
+        if span.parent is not None:
+            for key in ROLLUP:
+                if key in span.attributes:
+                    span.parent.add(key, span.attributes[key])
+        record = span.to_dict()
+        with self._lock:
+            self._spans.append(record)
+            metrics = self._metrics[span.name]
+            metrics["count"] += 1
+            metrics["sum"] += span.duration
+            metrics["errors"] += span.error is not None
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if span.duration <= bound:
+                    metrics["buckets"][i] += 1
+            for key in COUNTERS:
+                value = span.attributes.get(key)
+                if isinstance(value, (int, float)):
+                    metrics[key] += value
+            if span.parent is None:
+                self.last_trace_id = span.trace_id
+            if self.jsonl_path:
+                if self._jsonl is None:
+                    self._jsonl = open(self.jsonl_path, "a", encoding="utf-8", buffering=1)
+                self._jsonl.write(json.dumps(record, default=str) + "\n")
+
+    def get_trace(self, trace_id: str = None) -> List[dict]:
+        """Spans of one trace (default: the last finished one), parents before children."""
+        trace_id = trace_id or self.last_trace_id
+        with self._lock:
+            spans = [s for s in self._spans if s["trace_id"] == trace_id]
+        return sorted(spans, key=lambda s: s["start"])
+
+    def export_jsonl(self, path: str):
+        """Write the spans currently in memory to `path`, one JSON object per line."""
+        with self._lock:
+            spans = list(self._spans)
+        with open(path, "w", encoding="utf-8") as f:
+            for record in spans:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            metrics = {name: dict(m, buckets=list(m["buckets"])) for name, m in self._metrics.items()}
+        lines = [
+            "# HELP rag_span_duration_seconds Wall time of traced operations.",
+            "# TYPE rag_span_duration_seconds histogram",
+        ]
+        for name, m in sorted(metrics.items()):
+            for bound, count in zip(LATENCY_BUCKETS, m["buckets"]):
+                lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {count}')
+            lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {m["count"]}')
+            lines.append(f'rag_span_duration_seconds_sum{{span="{name}"}} {m["sum"]:.6f}')
+            lines.append(f'rag_span_duration_seconds_count{{span="{name}"}} {m["count"]}')
+        for key, help_text in (
+            ("errors", "Traced operations that raised."),
+            ("prompt_tokens", "Prompt tokens sent to the LLM."),
+            ("completion_tokens", "Completion tokens received from the LLM."),
+            ("retries", "Rate-limit / error retries of LLM calls."),
+            ("chunks", "Chunks retrieved from the knowledge base."),
+            ("context_bytes", "Bytes of retrieved context put into prompts."),
+        ):
+            lines.append(f"# HELP rag_{key}_total {help_text}")
+            lines.append(f"# TYPE rag_{key}_total counter")
+            for name, m in sorted(metrics.items()):
+                if m[key]:
+                    lines.append(f'rag_{key}_total{{span="{name}"}} {m[key]}')
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
+
+
+def annotate(**attributes):
+    """Set attributes on the current span, if there is one."""
+    span = _current_span.get()
+    if span is not None:
+        span.set(**attributes)
+
+
+def traced(name: str):
+    """Decorator: run the (sync or async) function inside a span called `name`."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = tracer.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes would flood the console
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "127.0.0.1"):
+    """Serve /metrics on a daemon thread, once per process. Does nothing if `port` is 0."""
+    global _metrics_server
+    if not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is None:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+            print(f"📈 Prometheus metrics on http://{host}:{port}/metrics")
+    return _metrics_server